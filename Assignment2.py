@@ -36,92 +36,100 @@ Assume the following orbit model and parameters:
 > The angle z is the starting point when Mars is first in opposition, and time is measured from that moment. The line used to define this angle is parallel to the Sun-Aries reference line.
 
 ### Lets draw a picture to visualize things
+
+Everything below can be imported without side effects. The plots and the CSV loader import matplotlib, pandas and IPython only when they are called, so `MarsEquantModel` and the searches can be imported into a worker process cheaply. The command line entry point is at the end of the file:
+
+    python Assignment2.py fit --search mars
+    python Assignment2.py evaluate 0 1.52 0.1 140 60 0.5238
+    python Assignment2.py plot fit --output fit.png
 """
 
-import matplotlib.pyplot as plt  # Import matplotlib for plotting
 import numpy as np  # Import numpy for numerical operations
 
-plt.figure(figsize=(12, 12))  # Create a new figure with size 12x12
-ax = plt.gca()  # Get the current axes
-ax.set_aspect('equal')  # Set aspect ratio to equal
+DATA_FILE = '01_data_mars_opposition_updated.csv'  # Opposition data used by the notebook
 
-# Parameters
-c = 60  # Angle in degrees
-r = 5.0  # Radius of Mars' orbit (5 times bigger than 1 unit)
-e1 = 1.5  # Distance of equant from Sun
-e2 = 30  # Angle of equant with respect to Sun-Aries line
+def _pyplot(output=None):
+    import matplotlib
+    if output is not None:
+        matplotlib.use('Agg')  # Draw without a display when the figure goes to a file
+    import matplotlib.pyplot as plt  # Import matplotlib for plotting
+    return plt
 
-# Calculate positions
-c_rad = np.radians(c)  # Convert angle to radians
-center_x, center_y = np.cos(c_rad), np.sin(c_rad)  # Calculate orbit center coordinates
-e2_rad = np.radians(e2)  # Convert equant angle to radians
-equant_x, equant_y = e1 * np.cos(e2_rad), e1 * np.sin(e2_rad)  # Calculate equant coordinates
+def _finishPlot(plt, output=None):
+    if output is None:
+        plt.show()  # Display the plot
+    else:
+        plt.savefig(output, bbox_inches='tight')  # Save the plot to a file
+        plt.close()
 
-# Draw the Sun
-sun = plt.Circle((0, 0), 0.1, color='orange', label='Sun')  # Create Sun circle
-ax.add_artist(sun)  # Add Sun to the plot
+def plotModelAssumptions(c=60, r=5.0, e1=1.5, e2=30, output=None):
+    plt = _pyplot(output)
 
-# Draw Mars' orbit
-orbit = plt.Circle((center_x, center_y), r, fill=False, color='red', label="Mars' Orbit")  # Create Mars orbit circle
-ax.add_artist(orbit)  # Add Mars orbit to the plot
+    plt.figure(figsize=(12, 12))  # Create a new figure with size 12x12
+    ax = plt.gca()  # Get the current axes
+    ax.set_aspect('equal')  # Set aspect ratio to equal
 
-# Draw Mars (45 degrees from orbit center)
-mars_angle = np.radians(45)  # Convert Mars angle to radians
-mars_x = center_x + r * np.cos(mars_angle)  # Calculate Mars x-coordinate
-mars_y = center_y + r * np.sin(mars_angle)  # Calculate Mars y-coordinate
-mars = plt.Circle((mars_x, mars_y), 0.1, color='red', label='Mars')  # Create Mars circle
-ax.add_artist(mars)  # Add Mars to the plot
+    # Calculate positions
+    c_rad = np.radians(c)  # Convert angle to radians
+    center_x, center_y = np.cos(c_rad), np.sin(c_rad)  # Calculate orbit center coordinates
+    e2_rad = np.radians(e2)  # Convert equant angle to radians
+    equant_x, equant_y = e1 * np.cos(e2_rad), e1 * np.sin(e2_rad)  # Calculate equant coordinates
 
-# Draw Sun-Aries reference line (0 degrees)
-plt.plot([0, 7], [0, 0], 'k--', label='Sun-Aries Line')  # Plot Sun-Aries line
+    # Draw the Sun
+    sun = plt.Circle((0, 0), 0.1, color='orange', label='Sun')  # Create Sun circle
+    ax.add_artist(sun)  # Add Sun to the plot
 
-# Draw line at c degrees
-plt.plot([0, 7*np.cos(c_rad)], [0, 7*np.sin(c_rad)], 'b--', label='c° Line')  # Plot c° line
+    # Draw Mars' orbit
+    orbit = plt.Circle((center_x, center_y), r, fill=False, color='red', label="Mars' Orbit")  # Create Mars orbit circle
+    ax.add_artist(orbit)  # Add Mars orbit to the plot
 
-# Mark orbit center
-plt.plot(center_x, center_y, 'ko', markersize=8, label='Orbit Center')  # Plot orbit center
+    # Draw Mars (45 degrees from orbit center)
+    mars_angle = np.radians(45)  # Convert Mars angle to radians
+    mars_x = center_x + r * np.cos(mars_angle)  # Calculate Mars x-coordinate
+    mars_y = center_y + r * np.sin(mars_angle)  # Calculate Mars y-coordinate
+    mars = plt.Circle((mars_x, mars_y), 0.1, color='red', label='Mars')  # Create Mars circle
+    ax.add_artist(mars)  # Add Mars to the plot
 
-# Mark equant
-plt.plot(equant_x, equant_y, 'go', markersize=8, label='Equant')  # Plot equant
-plt.text(equant_x, equant_y-0.3, f'(e1,e2)', ha='center', va='top')  # Add (e1,e2) text under equant
+    # Draw Sun-Aries reference line (0 degrees)
+    plt.plot([0, 7], [0, 0], 'k--', label='Sun-Aries Line')  # Plot Sun-Aries line
 
-# Add text to show 1 unit distance
-plt.text(center_x/2, center_y/2, '1 unit', rotation=c, ha='center', va='bottom')  # Add '1 unit' text
+    # Draw line at c degrees
+    plt.plot([0, 7*np.cos(c_rad)], [0, 7*np.sin(c_rad)], 'b--', label='c° Line')  # Plot c° line
 
-# Add r units along the line
-plt.text(center_x + r*np.cos(c_rad)/2, center_y + r*np.sin(c_rad)/2, 'r units',
-         rotation=c, ha='center', va='bottom')  # Add 'r units' text along the line
+    # Mark orbit center
+    plt.plot(center_x, center_y, 'ko', markersize=8, label='Orbit Center')  # Plot orbit center
 
-# Add angle label with arc for c
-angle = np.linspace(0, c_rad, 100)  # Create angle array
-arc_radius = 0.5  # Set arc radius
-plt.plot(arc_radius * np.cos(angle), arc_radius * np.sin(angle), 'g-')  # Plot arc
-plt.text(arc_radius * np.cos(c_rad/2), arc_radius * np.sin(c_rad/2), 'c°',
-         ha='center', va='center', fontsize=12, color='green')  # Add 'c°' text
+    # Mark equant
+    plt.plot(equant_x, equant_y, 'go', markersize=8, label='Equant')  # Plot equant
+    plt.text(equant_x, equant_y-0.3, f'(e1,e2)', ha='center', va='top')  # Add (e1,e2) text under equant
 
-plt.xlabel('X')  # Set x-axis label
-plt.ylabel('Y')  # Set y-axis label
-plt.title("Mars' Orbit Model Assumptions")  # Set plot title
-plt.legend(loc='upper left')  # Add legend
-plt.xlim(-6, 6)  # Set x-axis limits
-plt.ylim(-6, 6)  # Set y-axis limits
-plt.grid(True)  # Add grid
-plt.show()  # Display the plot
+    # Add text to show 1 unit distance
+    plt.text(center_x/2, center_y/2, '1 unit', rotation=c, ha='center', va='bottom')  # Add '1 unit' text
 
-print("Plot generated successfully.")  # Debug statement
+    # Add r units along the line
+    plt.text(center_x + r*np.cos(c_rad)/2, center_y + r*np.sin(c_rad)/2, 'r units',
+             rotation=c, ha='center', va='bottom')  # Add 'r units' text along the line
 
-"""### The dataset"""
+    # Add angle label with arc for c
+    angle = np.linspace(0, c_rad, 100)  # Create angle array
+    arc_radius = 0.5  # Set arc radius
+    plt.plot(arc_radius * np.cos(angle), arc_radius * np.sin(angle), 'g-')  # Plot arc
+    plt.text(arc_radius * np.cos(c_rad/2), arc_radius * np.sin(c_rad/2), 'c°',
+             ha='center', va='center', fontsize=12, color='green')  # Add 'c°' text
 
-import pandas as pd  # Import pandas library for data manipulation
-import matplotlib.pyplot as plt  # Import matplotlib for plotting
-from IPython.display import display  # Import display function for better output
+    plt.xlabel('X')  # Set x-axis label
+    plt.ylabel('Y')  # Set y-axis label
+    plt.title("Mars' Orbit Model Assumptions")  # Set plot title
+    plt.legend(loc='upper left')  # Add legend
+    plt.xlim(-6, 6)  # Set x-axis limits
+    plt.ylim(-6, 6)  # Set y-axis limits
+    plt.grid(True)  # Add grid
+    _finishPlot(plt, output)
 
-# Load the CSV file
-df = pd.read_csv('01_data_mars_opposition_updated.csv')  # Load data from CSV file
-print("Data loaded from CSV file")  # Debug statement
+"""### The dataset
 
-# Display the data as a table
-display(df)  # Display the DataFrame
+`loadOppositions` reads the CSV file and returns the `times` and `oppositions` arrays. With `show=True` it also displays the data, as the notebook did.
+"""
 
 """Columns J and K refer to the degree and minute of the geocentric latitudinal position of Mars in the ecliptic coordinate system. For our analysis, we will neglect these values and assume that Mars, Earth, the equant center, and the Sun all lie on the same plane. This simplification allows us to focus on the longitudinal aspects of Mars' orbit.
 
@@ -132,133 +140,149 @@ Columns F, G, H, I denote the ZodiacIndex, Degree, Minute, Second, respectively,
 Hence we can represnt the data as:
 """
 
-# Function to calculate longitude from zodiac data
-def calculate_longitude(row):
-    return row['ZodiacIndex'] * 30 + row['Degree'] + row['Minute.1'] / 60 + row['Second'] / 3600  # Calculate longitude
-
-# Calculate longitude and add it as a new column
-df['Longitude'] = df.apply(calculate_longitude, axis=1)  # Apply calculation to each row
-print("Longitude calculated for each observation")  # Debug statement
-
-# Select only the required columns
-df_modified = df[['Year', 'Month', 'Day', 'Hour', 'Minute', 'Longitude']]  # Select relevant columns
-print("Columns selected: Year, Month, Day, Hour, Minute, Longitude")  # Debug statement
+"""The whole catalog is converted at once: the longitude formula is applied to the columns, and the dates become numpy datetimes, so that `times` is the number of days since the first observation.
 
-# Display the modified dataframe
-display(df_modified)  # Show the modified DataFrame
-print("Modified dataframe displayed")  # Debug statement
-
-import pandas as pd
-from datetime import datetime, timedelta
-
-# Function to convert date and time to days elapsed
-def days_elapsed(row, reference_date):
-    date = datetime(int(row['Year']), int(row['Month']), int(row['Day']),
-                    int(row['Hour']), int(row['Minute']))  # Create datetime object, converting to int
-    return (date - reference_date).total_seconds() / (24 * 3600)  # Convert to days
+Parsing the CSV file is still the slow part for large catalogs, so `loadOppositions` saves the parsed arrays to a `.npy` file in `.opposition_cache` next to the CSV file. The name of the file is a fingerprint of the path, size and modification time of the CSV file, so an edited CSV file is parsed again. Later runs memory-map the `.npy` file instead of reading the CSV file, and worker processes map the same file instead of receiving a copy of the data. When the cache file cannot be written, for example next to a CSV file in a read-only directory, the parsed arrays are used without a cache.
+"""
 
-# Get the reference date (first observation)
-reference_date = datetime(int(df_modified['Year'].iloc[0]), int(df_modified['Month'].iloc[0]),
-                          int(df_modified['Day'].iloc[0]), int(df_modified['Hour'].iloc[0]),
-                          int(df_modified['Minute'].iloc[0]))  # Set reference date, converting to int
+import os  # Import os for the cache files
+import hashlib  # Import hashlib for the cache, dataset and grid fingerprints
+
+OPPOSITION_COLUMNS = ('Year', 'Month', 'Day', 'Hour', 'Minute', 'ZodiacIndex', 'Degree', 'Minute.1', 'Second')
+CACHE_VERSION = 1  # Change when the parsed format changes, so that old cache files are not used
+
+def _columnIndices(header):
+    names, seen = [], {}
+    for name in header.strip().split(','):
+        name = name.strip()
+        count = seen.get(name, 0)  # Number of earlier columns with this name
+        seen[name] = count + 1
+        names.append(name if count == 0 else f'{name}.{count}')  # Name duplicates like pandas: Minute, Minute.1
+    return [names.index(column) for column in OPPOSITION_COLUMNS]
+
+def parseOppositions(path=DATA_FILE):
+    with open(path) as file:
+        columns = _columnIndices(file.readline())  # Positions of the columns we need
+        table = np.loadtxt(file, delimiter=',', usecols=columns, ndmin=2)  # Parse all rows at once
+    if len(table) == 0:
+        raise ValueError(f"No observations in {path}")
+    year, month, day, hour, minute, zodiac, degree, arcminute, second = table.T.astype(float)
+
+    # Longitude = ZodiacIndex*30 + Degree + Minute/60 + Second/3600
+    oppositions = zodiac * 30 + degree + arcminute / 60 + second / 3600
+
+    # Date and time of each observation, to the minute
+    dates = (year.astype(int) - 1970).astype('datetime64[Y]') + (month.astype(int) - 1).astype('timedelta64[M]')
+    dates = dates.astype('datetime64[D]') + (day.astype(int) - 1).astype('timedelta64[D]')
+    dates = dates.astype('datetime64[m]') + (hour.astype(int) * 60 + minute.astype(int)).astype('timedelta64[m]')
+
+    # Days elapsed since the first observation
+    seconds = (dates - dates[0]).astype('timedelta64[s]').astype(np.int64)
+    times = seconds / (24 * 3600)  # Convert to days
+    return times, oppositions
+
+def oppositionCachePath(path=DATA_FILE):
+    stat = os.stat(path)
+    key = f'{CACHE_VERSION}:{os.path.realpath(path)}:{stat.st_size}:{stat.st_mtime_ns}'
+    digest = hashlib.sha1(key.encode()).hexdigest()  # Fingerprint of the CSV file
+    return os.path.join(os.path.dirname(os.path.abspath(path)), '.opposition_cache', f'{digest}.npy')
+
+def loadOppositions(path=DATA_FILE, show=False, cache=True):
+    if cache:
+        cache_path = oppositionCachePath(path)
+        data = None  # Parsed arrays when the cache file cannot be written
+        if not os.path.exists(cache_path):
+            data = np.stack(parseOppositions(path))  # times and oppositions as the rows of one array
+            try:
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                _writeAtomically(cache_path, lambda file: np.save(file, data))
+                data = None  # Written, so map it below
+            except OSError:
+                pass  # No cache, e.g. in a read-only directory: use the parsed arrays
+        times, oppositions = np.load(cache_path, mmap_mode='r') if data is None else data  # Mapped if cached
+    else:
+        times, oppositions = parseOppositions(path)
+
+    if show:
+        import pandas as pd  # Import pandas library for data manipulation
+        from IPython.display import display  # Import display function for better output
+        display(pd.read_csv(path))  # Display the CSV file
+        display(pd.DataFrame({'Days_Elapsed': times, 'Longitude': oppositions}))  # Show the final data
+
+    return times, oppositions
+
+"""`syntheticOppositions` makes a dataset of any size from known parameters: an opposition roughly every 780 days, as for the real data, with Gaussian noise of `noise` degrees on the longitudes. It is used to test and benchmark the fitter on more observations than the 12 in the CSV file.
+"""
 
-# Calculate days elapsed for each observation
-df_modified['Days_Elapsed'] = df_modified.apply(lambda row: days_elapsed(row, reference_date), axis=1)  # Calculate days elapsed
+def syntheticOppositions(n, r=1.5, s=0.524, e1=0.09, e2=150.0, z=55.0, noise=0.05, seed=0):
+    rng = np.random.default_rng(seed)  # Seeded so that the same n gives the same dataset
+    times = np.concatenate([[0.0], np.cumsum(rng.uniform(700, 900, n - 1))])  # Days since the first opposition
+    errors, _ = MarsEquantModelBatch(0, r, e1, e2, z, s, times, np.zeros(n))  # Noise free longitudes (mod 360)
+    oppositions = (errors + rng.normal(0, noise, n)) % 360  # Observed longitudes in degrees
+    return times, oppositions
 
-# Select only the required columns
-df_final = df_modified[['Days_Elapsed', 'Longitude']]  # Select relevant columns
+"""### Now lets plot these opposition data on plot
+Note that each datapoint is represented by a ray from sun along with (Ser_no, time, longtitude)
+"""
 
-# Display the final dataframe
-display(df_final)  # Show the final DataFrame
-print("Final dataframe displayed")  # Debug statement
+def plotObservedLongitudes(times, oppositions, c=60, r=5.0, e1=1.5, e2=30, output=None):
+    plt = _pyplot(output)
 
-import numpy as np  # Import numpy library
+    plt.figure(figsize=(12, 12))  # Create a new figure with size 12x12
+    ax = plt.gca()  # Get the current axes
+    ax.set_aspect('equal')  # Set aspect ratio to equal
 
-# Create 'times' numpy array from 'Days_Elapsed' column
-times = np.array(df_final['Days_Elapsed'])  # Convert Days_Elapsed to numpy array
-print("Created 'times' numpy array:", times)  # Print debug statement
+    # Calculate positions
+    c_rad = np.radians(c)  # Convert angle to radians
+    center_x, center_y = np.cos(c_rad), np.sin(c_rad)  # Calculate orbit center coordinates
+    e2_rad = np.radians(e2)  # Convert equant angle to radians
+    equant_x, equant_y = e1 * np.cos(e2_rad), e1 * np.sin(e2_rad)  # Calculate equant coordinates
 
-# Verify the length of 'times' array
-print("Length of 'times' array:", len(times))  # Print debug statement
+    # Draw the Sun
+    sun = plt.Circle((0, 0), 0.1, color='orange', label='Sun')  # Create Sun circle
+    ax.add_artist(sun)  # Add Sun to the plot
 
-assert len(times) == 12, "Error: 'times' array is not of length 12"  # Assert correct length
+    # Draw Mars' orbit
+    orbit = plt.Circle((center_x, center_y), r, fill=False, color='red', label="Mars' Orbit")  # Create Mars orbit circle
+    ax.add_artist(orbit)  # Add Mars orbit to the plot
 
-# Create 'oppositions' numpy array from 'Longitude' column
-oppositions = np.array(df_final['Longitude'])  # Convert Longitude to numpy array
-print("Created 'oppositions' numpy array:", oppositions)  # Print debug statement
+    # Draw Sun-Aries reference line (0 degrees)
+    plt.plot([0, 7], [0, 0], 'k--', label='Sun-Aries Line')  # Plot Sun-Aries line
 
-# Verify the length of 'oppositions' array
-print("Length of 'oppositions' array:", len(oppositions))  # Print debug statement
+    # Draw line at c degrees
+    plt.plot([0, 7*np.cos(c_rad)], [0, 7*np.sin(c_rad)], 'b--', label='c° Line')  # Plot c° line
 
-assert len(oppositions) == 12, "Error: 'oppositions' array is not of length 12"  # Assert correct length
+    # Mark orbit center
+    plt.plot(center_x, center_y, 'ko', markersize=8, label='Orbit Center')  # Plot orbit center
 
-"""### Now lets plot these opposition data on plot
-Note that each datapoint is represented by a ray from sun along with (Ser_no, time, longtitude)
-"""
+    # Mark equant
+    plt.plot(equant_x, equant_y, 'go', markersize=8, label='Equant')  # Plot equant
+    plt.text(equant_x, equant_y-0.3, f'(e1,e2)', ha='center', va='top')  # Add (e1,e2) text under equant
 
-import matplotlib.pyplot as plt  # Import matplotlib for plotting
-import numpy as np  # Import numpy for numerical operations
+    # Plot longitudes as rays from the sun
+    for i, (days, longitude) in enumerate(zip(times, oppositions)):  # Iterate through oppositions with index
+        angle = np.radians(longitude)  # Convert longitude to radians
+        x = 7 * np.cos(angle)  # Calculate x-coordinate
+        y = 7 * np.sin(angle)  # Calculate y-coordinate
+        plt.plot([0, x], [0, y], 'r-', alpha=0.5)  # Plot ray
+        plt.text(x*1.1, y*1.1, f'({i+1}, {days:.1f}, {longitude:.1f})', fontsize=8, ha='center', va='center')  # Add text on the ray
 
-plt.figure(figsize=(12, 12))  # Create a new figure with size 12x12
-ax = plt.gca()  # Get the current axes
-ax.set_aspect('equal')  # Set aspect ratio to equal
-
-# Parameters
-c = 60  # Angle in degrees
-r = 5.0  # Radius of Mars' orbit (5 times bigger than 1 unit)
-e1 = 1.5  # Distance of equant from Sun
-e2 = 30  # Angle of equant with respect to Sun-Aries line
-
-# Calculate positions
-c_rad = np.radians(c)  # Convert angle to radians
-center_x, center_y = np.cos(c_rad), np.sin(c_rad)  # Calculate orbit center coordinates
-e2_rad = np.radians(e2)  # Convert equant angle to radians
-equant_x, equant_y = e1 * np.cos(e2_rad), e1 * np.sin(e2_rad)  # Calculate equant coordinates
-
-# Draw the Sun
-sun = plt.Circle((0, 0), 0.1, color='orange', label='Sun')  # Create Sun circle
-ax.add_artist(sun)  # Add Sun to the plot
-
-# Draw Mars' orbit
-orbit = plt.Circle((center_x, center_y), r, fill=False, color='red', label="Mars' Orbit")  # Create Mars orbit circle
-ax.add_artist(orbit)  # Add Mars orbit to the plot
-
-# Draw Sun-Aries reference line (0 degrees)
-plt.plot([0, 7], [0, 0], 'k--', label='Sun-Aries Line')  # Plot Sun-Aries line
-
-# Draw line at c degrees
-plt.plot([0, 7*np.cos(c_rad)], [0, 7*np.sin(c_rad)], 'b--', label='c° Line')  # Plot c° line
-
-# Mark orbit center
-plt.plot(center_x, center_y, 'ko', markersize=8, label='Orbit Center')  # Plot orbit center
-
-# Mark equant
-plt.plot(equant_x, equant_y, 'go', markersize=8, label='Equant')  # Plot equant
-plt.text(equant_x, equant_y-0.3, f'(e1,e2)', ha='center', va='top')  # Add (e1,e2) text under equant
-
-# Plot longitudes as rays from the sun
-for i, (days, longitude) in enumerate(zip(times, oppositions)):  # Iterate through oppositions with index
-    angle = np.radians(longitude)  # Convert longitude to radians
-    x = 7 * np.cos(angle)  # Calculate x-coordinate
-    y = 7 * np.sin(angle)  # Calculate y-coordinate
-    plt.plot([0, x], [0, y], 'r-', alpha=0.5)  # Plot ray
-    plt.text(x*1.1, y*1.1, f'({i+1}, {days:.1f}, {longitude:.1f})', fontsize=8, ha='center', va='center')  # Add text on the ray
-
-plt.xlabel('X')  # Set x-axis label
-plt.ylabel('Y')  # Set y-axis label
-plt.title("Mars' Orbit Model with Observed Longitudes")  # Set plot title
-plt.legend(loc='upper left')  # Add legend
-plt.xlim(-7, 7)  # Set x-axis limits
-plt.ylim(-7, 7)  # Set y-axis limits
-plt.grid(True)  # Add grid
-plt.show()  # Display the plot
+    plt.xlabel('X')  # Set x-axis label
+    plt.ylabel('Y')  # Set y-axis label
+    plt.title("Mars' Orbit Model with Observed Longitudes")  # Set plot title
+    plt.legend(loc='upper left')  # Add legend
+    plt.xlim(-7, 7)  # Set x-axis limits
+    plt.ylim(-7, 7)  # Set y-axis limits
+    plt.grid(True)  # Add grid
+    _finishPlot(plt, output)
 
 """### Now lets write a function to calculate error for specific values of c,r,e1,e2,z,s,times,oppositions"""
 
 import numpy as np
 
-def MarsEquantModel(c, r, e1, e2, z, s, times, oppositions):
-    errors = np.zeros(12)  # Initialize errors array with zeros
+def MarsEquantModel(c, r, e1, e2, z, s, times, oppositions, threshold=None, ranking=None):
+    n = len(times)  # Number of observations
+    errors = np.zeros(n)  # Initialize errors array with zeros
 
     # Convert angles to radians
     c_rad = np.radians(c)  # Convert c to radians
@@ -269,7 +293,14 @@ def MarsEquantModel(c, r, e1, e2, z, s, times, oppositions):
     center_x, center_y = np.cos(c_rad), np.sin(c_rad)  # Calculate orbit center coordinates
     equant_x, equant_y = e1 * np.cos(e2_rad), e1 * np.sin(e2_rad)  # Calculate equant coordinates
 
-    for i in range(12):  # Loop through all 12 observations
+    # With a threshold, score the observations that reject most often first and stop at the first
+    # error that reaches the threshold. Errors that were not computed are left as NaN.
+    order = range(n)
+    if threshold is not None:
+        errors[:] = np.nan
+        order = ranking.order() if ranking is not None else order
+
+    for computed, i in enumerate(order, start=1):  # Loop through all observations
         t = times[i]  # Get current time
         angle = z_rad + np.radians(s * t)  # Calculate angle of Mars around equant
 
@@ -288,201 +319,2554 @@ def MarsEquantModel(c, r, e1, e2, z, s, times, oppositions):
         error = (predicted_long - oppositions[i] + 180) % 360 - 180  # Calculate smallest angle difference
         errors[i] = error  # Store error in array
 
+        # Stop if this parameter set can no longer beat the threshold
+        if threshold is not None and abs(error) >= threshold:
+            if ranking is not None:
+                ranking.record([i], computed, n)
+            return errors, np.nanmax(np.abs(errors))  # The max error is at least this much
+
+    if threshold is not None and ranking is not None:
+        ranking.record([], n, n)
+
     max_error = np.max(np.abs(errors))  # Calculate maximum absolute error
 
     return errors, max_error  # Return errors array and max error
 
-"""### Now lets fix r and s. Do a discretised exhaustive search over c, over e = (e1,e2), and over z to minimise the maximum angular error for the given r and s."""
+"""### A batched version of the model
+
+`MarsEquantModel` scores a single (c, r, e1, e2, z, s) tuple. `MarsEquantModelBatch` takes arrays of parameters that broadcast against each other (for example the open mesh returned by `innerGrid`) and scores all of them in one call. The arithmetic is the same as in `MarsEquantModel`, step for step, so both give identical errors.
+
+The errors array has the broadcast shape of the parameters with the observations on the last axis, and the max error array has the broadcast shape of the parameters.
+
+The errors array holds one error per parameter set and observation, which is too much memory for large batches of many observations. The searches only need the max errors, so they call `maxErrorsBatch` instead. It scores the observations in chunks of at most `BATCH_ELEMENTS` errors and keeps a running max, so memory stays bounded however many observations there are, and `times` and `oppositions` can be memory-mapped files that are read chunk by chunk. The errors of the best point are then recomputed on their own.
+"""
 
 import numpy as np
 
-def bestOrbitInnerParams(r, s, times, oppositions):
-    # Define search ranges and step sizes
-    c_range = np.arange(0, 360, 20)  # Search c from 0 to 360 in steps of 10 degrees
-    e1_range = np.arange(0, 0.2, 0.1)  # Search e1 from 0 to 0.2 in steps of 0.01
-    e2_range = np.arange(0, 360, 20)  # Search e2 from 0 to 360 in steps of 10 degrees
-    z_range = np.arange(0, 360, 20)  # Search z from 0 to 360 in steps of 10 degrees
-    total_iterations = len(c_range) * len(e1_range) * len(e2_range) * len(z_range)  # Calculate total number of iterations
-    current_iteration = 0  # Initialize current iteration counter
+# Default search ranges for c, e1, e2 and z used by the inner search
+C_RANGE = np.arange(0, 360, 20)  # Search c from 0 to 360 in steps of 20 degrees
+E1_RANGE = np.arange(0, 0.2, 0.1)  # Search e1 from 0 to 0.2 in steps of 0.1
+E2_RANGE = np.arange(0, 360, 20)  # Search e2 from 0 to 360 in steps of 20 degrees
+Z_RANGE = np.arange(0, 360, 20)  # Search z from 0 to 360 in steps of 20 degrees
+DEFAULT_INNER_GRID = (C_RANGE, E1_RANGE, E2_RANGE, Z_RANGE)  # Grid spec: (c_range, e1_range, e2_range, z_range)
+
+def innerGrid(grid=None):
+    c_range, e1_range, e2_range, z_range = DEFAULT_INNER_GRID if grid is None else grid  # Unpack the grid spec
+    return np.ix_(c_range, e1_range, e2_range, z_range)  # Open mesh with axes (c, e1, e2, z)
+
+def MarsEquantModelBatch(c, r, e1, e2, z, s, times, oppositions, threshold=None, ranking=None):
+    times = np.asarray(times, dtype=float)  # Observation times as a float array
+    oppositions = np.asarray(oppositions, dtype=float)  # Observed longitudes as a float array
+    params = [np.asarray(p) for p in (c, r, e1, e2, z, s)]  # Parameters as arrays
+    if threshold is not None:
+        return _earlyAbandonBatch(params, times, oppositions, threshold, ranking)
+    shape = np.broadcast_shapes(*(p.shape for p in params))  # Shape of the batch of parameter sets
+    c, r, e1, e2, z, s = (p[..., np.newaxis] for p in params)  # Add a trailing observation axis
 
-    best_error = float('inf')  # Initialize best error to infinity
-    best_params = None  # Initialize best parameters
+    # Convert angles to radians
+    e2_rad = np.radians(e2)  # Convert e2 to radians
+    z_rad = np.radians(z)  # Convert z to radians
 
-    # Nested loops for exhaustive search
-    for c in c_range:
-        for e1 in e1_range:
-            for e2 in e2_range:
-                for z in z_range:
-                    # Calculate errors for current parameter set
-                    errors, max_error = MarsEquantModel(c, r, e1, e2, z, s, times, oppositions)
-                    # Update current iteration
-                    current_iteration += 1  # Increment the iteration counter
-                    # Print debug statement for current parameter set and error
-                    print(f"Debug: Iteration {current_iteration}/{total_iterations}: c={c:.2f}, e1={e1:.4f}, e2={e2:.2f}, z={z:.2f}, max_error={max_error:.4f}, best_overall_max_error={best_error:.4f}")  # Print current iteration, parameters, max error, and best error
-                    # Update best parameters if current error is lower
-                    if max_error < best_error:
-                        best_error = max_error
-                        best_params = (c, e1, e2, z, errors, max_error)
-
-
-    # Unpack best parameters
-    c, e1, e2, z, errors, max_error = best_params
+    # Equant position. The orbit centre (set by c) does not enter the predicted longitude
+    # because Mars is placed at distance r from the equant, so it is not computed here.
+    equant_x, equant_y = e1 * np.cos(e2_rad), e1 * np.sin(e2_rad)  # Calculate equant coordinates
 
-    return c, e1, e2, z, errors, max_error
+    angle = z_rad + np.radians(s * times)  # Angle of Mars around the equant for every observation
+    mars_x = equant_x + r * np.cos(angle)  # X-coordinate of Mars relative to Sun
+    mars_y = equant_y + r * np.sin(angle)  # Y-coordinate of Mars relative to Sun
 
-"""### Fix r. Do a discretised search for s"""
+    predicted_long = np.degrees(np.arctan2(mars_y, mars_x)) % 360  # Predicted longitudes in 0-360 range
+    errors = (predicted_long - oppositions + 180) % 360 - 180  # Smallest angle differences
+    max_errors = np.max(np.abs(errors), axis=-1)  # Maximum absolute error of each parameter set
 
-def bestS(r, times, oppositions):
-    # Define search range for s
-    s_range = np.linspace(360/687 * 0.9, 360/687 * 1.1, 10)  # Search around 360/687, ±10%, with 10 points
+    # Parameters that were not used (c) still count as batch axes. Broadcasting gives read-only
+    # views, so the arrays are only broadcast when c adds axes.
+    if shape != max_errors.shape:
+        errors = np.broadcast_to(errors, shape + errors.shape[-1:])  # Broadcast errors to the full batch shape
+        max_errors = np.broadcast_to(max_errors, shape)  # Broadcast max errors to the full batch shape
 
-    best_error = float('inf')
-    best_params = None
+    return errors, max_errors  # Return errors array and max error array
 
-    for s in s_range:
-        c, e1, e2, z, errors, max_error = bestOrbitInnerParams(r, s, times, oppositions)
+BATCH_ELEMENTS = 2 ** 21  # Largest number of errors maxErrorsBatch computes at once (16 MB of float64)
 
-        if max_error < best_error:
-            best_error = max_error
-            best_params = (s, errors, max_error)
+def maxErrorsBatch(c, r, e1, e2, z, s, times, oppositions, chunk=None):
+    return compute_backend.maxErrors(c, r, e1, e2, z, s, times, oppositions, chunk)  # Runs on the current backend
 
-        print(f"Debug: s={s:.6f}, max_error={max_error:.4f}, best_overall_max_error={best_error:.4f}")
+"""### Compute backends
 
-    return best_params
+`maxErrorsBatch` is the kernel of the searches, and it runs on a compute backend:
 
-# Set a fixed value for r (you may need to adjust this based on your previous findings)
-r_fixed = 1.52  # This is an approximate value for Mars' orbit radius in AU
+- `NumpyBackend` (`numpy`) is the reference and the default. It uses the arithmetic of `MarsEquantModelBatch` and scores the observations in chunks, keeping a running max error.
+- `NumbaBackend` (`numba`) compiles a fused loop with numba. The loop computes the errors of each parameter set one at a time and keeps the largest, so it needs no temporary arrays. It needs numba, which is imported when the backend is created.
+- `ThreadedBackend` (`threads`) splits the parameter sets over a pool of threads. Each thread runs the numba loop when numba is installed and the numpy kernel otherwise. Both release the GIL. The pool is started on the first call, and `close()` shuts it down.
 
-# Use the bestS function to find the optimal s and other parameters
-best_s, best_errors, best_max_error = bestS(r_fixed, times, oppositions)
+`selectBackend(name)` makes a backend the current one, for this process and for the worker processes of the searches. It first runs a self-check, `checkBackend`, which scores a small synthetic batch on the backend and on the reference. The backend is used only if every max error agrees within `BACKEND_TOLERANCE` degrees. Otherwise, or when numba is missing, `selectBackend` falls back to numpy. `auto` takes the first backend in `BACKEND_ORDER` that works. The thread pool of a backend that is rejected or replaced is shut down, and the worker processes of the searches use one thread each, since they already run in parallel. The command line selects the backend with `--backend` before it runs a command.
 
-# Now use the best s to find the other optimal parameters
-best_c, best_e1, best_e2, best_z, _, _ = bestOrbitInnerParams(r_fixed, best_s, times, oppositions)
+numpy with numpy threads gives exactly the results of `MarsEquantModelBatch`. The numba loop uses its own cos, sin and arctan2, so its errors can differ from numpy in the last bits, and that can change which of two equally good grid points wins a tie. With the numpy backend, `innerSearches` looks up rotation tables (see below) instead of calling the kernel. With the other backends it calls the kernel.
+"""
 
-# Print the best values
-print(f"Best parameters:")
-print(f"r = {r_fixed:.6f}")
-print(f"s = {best_s:.6f}")
-print(f"c = {best_c:.6f}")
-print(f"e1 = {best_e1:.6f}")
-print(f"e2 = {best_e2:.6f}")
-print(f"z = {best_z:.6f}")
-print(f"Maximum error = {best_max_error:.6f}")
+import math  # Import math for the scalar functions of the fused loop
+
+BACKEND_TOLERANCE = 1e-9  # Largest difference in max error (degrees) a backend may have from numpy
+
+def _flatParams(c, r, e1, e2, z, s):
+    # Shape of the batch, shape without c, and the flat (r, e1, e2, z, s) arrays of the parameter sets
+    params = [np.asarray(p, dtype=float) for p in (c, r, e1, e2, z, s)]
+    shape = np.broadcast_shapes(*(p.shape for p in params))
+    used = np.broadcast_arrays(*params[1:])  # c does not enter the errors
+    return shape, used[0].shape, [np.ascontiguousarray(p).ravel() for p in used]
+
+def _fusedMaxErrors(r, e1, e2, z, s, times, oppositions, out):
+    # Same arithmetic as MarsEquantModelBatch, one error at a time
+    for p in range(len(r)):
+        e2_rad, z_rad = math.radians(e2[p]), math.radians(z[p])
+        equant_x, equant_y = e1[p] * math.cos(e2_rad), e1[p] * math.sin(e2_rad)  # Equant coordinates
+        worst = 0.0
+        for i in range(len(times)):
+            angle = z_rad + math.radians(s[p] * times[i])  # Angle of Mars around the equant
+            mars_x = equant_x + r[p] * math.cos(angle)
+            mars_y = equant_y + r[p] * math.sin(angle)
+            predicted_long = math.degrees(math.atan2(mars_y, mars_x)) % 360
+            error = abs((predicted_long - oppositions[i] + 180) % 360 - 180)
+            if error > worst:
+                worst = error
+        out[p] = worst
+
+class NumpyBackend:
+    name = 'numpy'
+    tables = True  # innerSearches may use rotation tables instead of the kernel
+
+    def maxErrors(self, c, r, e1, e2, z, s, times, oppositions, chunk=None):
+        params = [np.asarray(p) for p in (c, r, e1, e2, z, s)]  # Parameters as arrays
+        shape = np.broadcast_shapes(*(p.shape for p in params))  # Shape of the batch of parameter sets
+        size = int(np.prod(np.broadcast_shapes(*(p.shape for p in params[1:]))))  # Sets that are scored (not c)
+        chunk = max(1, BATCH_ELEMENTS // size) if chunk is None else chunk  # Observations scored at once
+
+        # Score the observations chunk by chunk, keeping the largest error of each parameter set.
+        # c does not enter the errors, so it is left out and broadcast back at the end.
+        max_errors = None
+        for start in range(0, len(times), chunk):
+            _, part = MarsEquantModelBatch(0, *params[1:], times[start:start + chunk],
+                                           oppositions[start:start + chunk])
+            max_errors = part.copy() if max_errors is None else np.maximum(max_errors, part)
+
+        return np.broadcast_to(max_errors, shape)  # Broadcast max errors to the full batch shape
+
+class NumbaBackend:
+    name = 'numba'
+    tables = False
+
+    def __init__(self):
+        import numba  # Raises ImportError when numba is not installed
+
+        self.kernel = numba.njit(nogil=True, cache=True)(_fusedMaxErrors)  # Compiled on the first call
+
+    def run(self, flat, times, oppositions, out):
+        self.kernel(*flat, times, oppositions, out)
+
+    def maxErrors(self, c, r, e1, e2, z, s, times, oppositions, chunk=None):
+        shape, used_shape, flat = _flatParams(c, r, e1, e2, z, s)
+        out = np.empty(len(flat[0]))
+        self.run(flat, np.asarray(times, dtype=float), np.asarray(oppositions, dtype=float), out)
+        return np.broadcast_to(out.reshape(used_shape), shape)
+
+class ThreadedBackend:
+    name = 'threads'
+    tables = False
+
+    def __init__(self, threads=None):
+        self.threads = threads or os.cpu_count() or 1  # Number of threads
+        try:
+            self.kernel = NumbaBackend()  # The fused loop, when numba is installed
+        except ImportError:
+            self.kernel = None  # The numpy kernel
+        self.pool = None  # Thread pool, created on the first call and shut down by close
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def _score(self, flat, times, oppositions, out, part):
+        flat = [p[part] for p in flat]  # Parameter sets of this thread
+        if self.kernel is None:
+            out[part] = NumpyBackend().maxErrors(0, *flat, times, oppositions)
+        else:
+            self.kernel.run(flat, times, oppositions, out[part])
+
+    def maxErrors(self, c, r, e1, e2, z, s, times, oppositions, chunk=None):
+        shape, used_shape, flat = _flatParams(c, r, e1, e2, z, s)
+        times, oppositions = np.asarray(times, dtype=float), np.asarray(oppositions, dtype=float)
+        out = np.empty(len(flat[0]))
+        if self.pool is None:
+            from concurrent.futures import ThreadPoolExecutor  # Imported here because it is slow to import
+
+            self.pool = ThreadPoolExecutor(max_workers=self.threads)
+        bounds = np.linspace(0, len(out), min(self.threads, len(out)) + 1).astype(int)  # One share per thread
+        parts = [slice(a, b) for a, b in zip(bounds[:-1], bounds[1:])]
+        for future in [self.pool.submit(self._score, flat, times, oppositions, out, part) for part in parts]:
+            future.result()  # Raise the errors of the threads
+        return np.broadcast_to(out.reshape(used_shape), shape)
+
+BACKENDS = {'numpy': NumpyBackend, 'numba': NumbaBackend, 'threads': ThreadedBackend}  # Backends by name
+BACKEND_ORDER = ('numba', 'threads', 'numpy')  # Backends tried by selectBackend('auto')
+
+def checkBackend(backend):
+    # Largest difference from the reference on a small synthetic batch
+    times, oppositions = syntheticOppositions(24)
+    params = np.ix_([0], [1.4, 1.6], [0.0, 0.1], np.arange(0, 360, 45), np.arange(0, 360, 45), [0.51, 0.53])
+    expected = NumpyBackend().maxErrors(*params, times, oppositions)
+    got = backend.maxErrors(*params, times, oppositions)
+    return np.max(np.abs(got - expected)) if got.shape == expected.shape else np.inf
+
+def _closeBackend(backend):
+    if isinstance(backend, ThreadedBackend):
+        backend.close()  # Stop the threads of a backend that is no longer used
+
+def selectBackend(name='numpy', check=True, threads=None):
+    global compute_backend
+    for candidate in (BACKEND_ORDER if name == 'auto' else (name,)):
+        try:
+            backend = ThreadedBackend(threads) if candidate == 'threads' else BACKENDS[candidate]()
+        except ImportError:
+            continue  # numba is not installed
+        if not check or checkBackend(backend) <= BACKEND_TOLERANCE:
+            break
+        _closeBackend(backend)  # It disagrees with the reference
+    else:
+        backend = NumpyBackend()  # Fall back to the reference
+    if backend is not compute_backend:
+        _closeBackend(compute_backend)  # Replaced
+    compute_backend = backend
+    return backend
+
+compute_backend = NumpyBackend()  # Backend of maxErrorsBatch
+
+"""### Progress and performance telemetry
+
+The searches are silent. To follow a long search, pass a `SearchTelemetry` as `telemetry=`. It counts the parameter sets scored, keeps the best max error over time and the time spent in each search level (`bestS`, `bestMarsOrbitParams`, each branch-and-bound level, ...). If a `callback` is given, it is called with `summary()` at most once every `interval` seconds, and once more when the outermost level finishes. `printProgress` is a callback that prints one line.
+
+`profileSearch` runs any search under cProfile, or under a simple sampling profiler that looks at the stack every few milliseconds, and writes the report to a file.
+"""
 
-"""### Fix s Do discrete search for r"""
+import time  # Import time for timing the searches
+from contextlib import contextmanager  # Import contextmanager for timing search levels
+
+class SearchTelemetry:
+    def __init__(self, callback=None, interval=1.0):
+        self.callback = callback  # Called with summary() at most once every interval seconds
+        self.interval = interval  # Seconds between progress reports
+        self.evaluations = 0  # Number of parameter sets scored
+        self.transcendental_calls = 0  # cos, sin and arctan2 values computed
+        self.direct_transcendental_calls = 0  # The same without rotation tables
+        self.residuals_computed = 0  # Residuals computed by early abandon
+        self.residuals_skipped = 0  # Residuals early abandon did not need
+        self.best_error = float('inf')  # Best max error so far
+        self.best_history = []  # (seconds since start, best max error) each time the best improved
+        self.level_times = {}  # Seconds spent in each search level
+        self.current_level = None  # Innermost level that is running
+        self._start = time.perf_counter()  # Start of the telemetry
+        self._last_report = float('-inf')  # Time of the last progress report
+        self._depth = 0  # Number of levels running
+
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def count(self, evaluations):
+        self.evaluations += int(evaluations)
+        self.report()
+
+    def transcendentals(self, calls, direct_calls):
+        self.transcendental_calls += int(calls)
+        self.direct_transcendental_calls += int(direct_calls)
+
+    def residuals(self, computed, skipped):
+        self.residuals_computed += int(computed)
+        self.residuals_skipped += int(skipped)
+
+    def best(self, max_error):
+        if max_error < self.best_error:
+            self.best_error = float(max_error)
+            self.best_history.append((self.elapsed(), self.best_error))
+        self.report()
+
+    @contextmanager
+    def level(self, name):
+        outer, self.current_level = self.current_level, name  # Remember the enclosing level
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.level_times[name] = self.level_times.get(name, 0.0) + time.perf_counter() - start
+            self._depth -= 1
+            if self._depth == 0:
+                self.report(force=True)  # Final report when the outermost level finishes
+            self.current_level = outer
+
+    def summary(self):
+        elapsed = self.elapsed()
+        return {'elapsed': elapsed, 'evaluations': self.evaluations,
+                'evaluations_per_second': self.evaluations / elapsed if elapsed > 0 else 0.0,
+                'best_error': self.best_error, 'level': self.current_level,
+                'transcendental_calls': self.transcendental_calls,
+                'direct_transcendental_calls': self.direct_transcendental_calls,
+                'residuals_computed': self.residuals_computed, 'residuals_skipped': self.residuals_skipped,
+                'level_times': dict(self.level_times), 'best_history': list(self.best_history)}
+
+    def report(self, force=False):
+        if self.callback is None:
+            return
+        now = time.perf_counter()
+        if force or now - self._last_report >= self.interval:
+            self._last_report = now
+            self.callback(self.summary())
+
+def printProgress(summary):
+    print(f"[{summary['elapsed']:8.2f}s] {summary['level']}: {summary['evaluations']} evaluations "
+          f"({summary['evaluations_per_second']:.0f}/s), best max error {summary['best_error']:.6f}")
+
+def _sampleStack(thread_id, interval, stop, self_counts, total_counts):
+    import sys
+    while not stop.wait(interval):
+        frame = sys._current_frames().get(thread_id)  # Current stack of the profiled thread
+        seen = set()  # Functions counted for this sample, so recursion is counted once
+        leaf = True
+        while frame is not None:
+            code = frame.f_code
+            name = f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})'
+            if leaf:
+                self_counts[name] = self_counts.get(name, 0) + 1  # Function that was running
+                leaf = False
+            if name not in seen:
+                total_counts[name] = total_counts.get(name, 0) + 1  # Function on the stack
+                seen.add(name)
+            frame = frame.f_back
+
+def profileSearch(function, *args, output='search_profile.txt', profiler='cprofile', interval=0.005, **kwargs):
+    if profiler == 'cprofile':
+        import cProfile
+        import pstats
+        profile = cProfile.Profile()
+        result = profile.runcall(function, *args, **kwargs)  # Run the search under cProfile
+        with open(output, 'w') as file:
+            pstats.Stats(profile, stream=file).sort_stats('cumulative').print_stats(50)
+        return result
+
+    if profiler == 'sampling':
+        import threading
+        self_counts, total_counts = {}, {}  # Samples per function: running itself, and anywhere on the stack
+        stop = threading.Event()
+        sampler = threading.Thread(target=_sampleStack, daemon=True,
+                                   args=(threading.get_ident(), interval, stop, self_counts, total_counts))
+        sampler.start()
+        try:
+            result = function(*args, **kwargs)  # Run the search while the sampler looks at its stack
+        finally:
+            stop.set()
+            sampler.join()
+
+        samples = max(1, sum(self_counts.values()))
+        with open(output, 'w') as file:
+            file.write(f'{samples} samples every {interval * 1000:.1f} ms\n\n')
+            file.write(f"{'total %':>8} {'self %':>8}  function\n")
+            for name, count in sorted(total_counts.items(), key=lambda item: -item[1])[:50]:
+                file.write(f'{100 * count / samples:8.1f} {100 * self_counts.get(name, 0) / samples:8.1f}  {name}\n')
+        return result
+
+    raise ValueError(f"Unknown profiler {profiler!r}, use 'cprofile' or 'sampling'")
+
+"""### Rotation tables
+
+For a fixed s, Mars is at angle z + s t around the equant. In the grid searches z and e2 only take the values of their ranges, so the cos and sin of every z + s t and of every e2 can be computed once and then looked up for every (r, e1) and every (e1, e2). The equant position of each (e1, e2) then costs two multiplications. The orbit centre (set by c) does not enter the errors, so nothing is computed for c.
+
+`RotationTables` holds these tables for some s values, the z and e2 ranges of a grid and a dataset. `errors` and `maxErrors` take the e2, z and s as positions in the tables and use the same arithmetic as `MarsEquantModelBatch` with the cos and sin looked up, so the errors are identical. That leaves one arctan2 per error, instead of a cos, a sin and an arctan2 per error plus a cos and a sin per parameter set. `stats()` counts both, and the counts are also added to the telemetry.
+
+Stepping z by a rotation (multiplying by cos and sin of the z step) would need no table, but it rounds differently from cos(z + s t). The errors would change in the last bits and ties could go to another point, so the tables are used instead. They hold s values × z values × observations numbers each and are only built when that is at most `TABLE_ELEMENTS`.
+"""
 
-def bestR(s, times, oppositions):
-    s_fixed = 0.518195  # Fixed value for s
-    r_range = np.linspace(1.52 * 0.9, 1.52 * 1.1, 10)  # Search around 1.52, ±10%, with 20 points
+TABLE_ELEMENTS = 2 ** 22  # Largest cos or sin table of RotationTables (32 MB of float64)
+
+class RotationTables:
+    def __init__(self, s_values, times, oppositions, z_values, e2_values, telemetry=None, dtype=np.float64):
+        self.telemetry = SearchTelemetry() if telemetry is None else telemetry  # Silent unless telemetry is given
+        self.dtype = dtype  # Type of the tables and of the errors
+        self.times = np.asarray(times, dtype=float)  # Observation times as a float array
+        self.oppositions = np.asarray(oppositions, dtype=float).astype(dtype, copy=False)  # Observed longitudes
+
+        # Angle of Mars around the equant, with axes (s, z, observation)
+        s = np.asarray(s_values, dtype=float).reshape(-1, 1, 1)
+        angle = np.radians(np.asarray(z_values))[:, np.newaxis] + np.radians(s * self.times)
+        self.angle_cos = np.cos(angle).astype(dtype, copy=False)
+        self.angle_sin = np.sin(angle).astype(dtype, copy=False)
+
+        # Direction of the equant for every e2
+        e2_rad = np.radians(np.asarray(e2_values))
+        self.e2_cos, self.e2_sin = np.cos(e2_rad).astype(dtype, copy=False), np.sin(e2_rad).astype(dtype, copy=False)
+
+        self.points = 0  # Parameter sets scored
+        self.errors_computed = 0  # Errors computed
+        self.calls = 2 * (angle.size + e2_rad.size)  # Transcendental calls, starting with the tables
+        self.direct_calls = 0  # Transcendental calls MarsEquantModelBatch would have made
+        self.telemetry.transcendentals(self.calls, 0)
+
+    @staticmethod
+    def fits(n_s, n_z, n_observations):
+        return n_s * n_z * n_observations <= TABLE_ELEMENTS
+
+    def _count(self, points, errors):
+        direct = 2 * points + 3 * errors  # cos and sin of e2, and cos, sin and arctan2 of every error
+        self.points += points
+        self.errors_computed += errors
+        self.calls += errors  # One arctan2 per error
+        self.direct_calls += direct
+        self.telemetry.transcendentals(errors, direct)
+
+    def errors(self, r, e1, i_s, i_e2, i_z, observations=slice(None), count_points=True):
+        # Equant position and rotation of Mars, looked up. With a slice of observations they go on a trailing axis.
+        r, e1 = np.asarray(r, dtype=self.dtype), np.asarray(e1, dtype=self.dtype)
+        equant_x, equant_y = e1 * self.e2_cos[i_e2], e1 * self.e2_sin[i_e2]  # Calculate equant coordinates
+        angle_cos, angle_sin = self.angle_cos[i_s, i_z, observations], self.angle_sin[i_s, i_z, observations]
+        if isinstance(observations, slice):
+            equant_x, equant_y = equant_x[..., np.newaxis], equant_y[..., np.newaxis]
+
+        mars_x = equant_x + r * angle_cos  # X-coordinate of Mars relative to Sun
+        mars_y = equant_y + r * angle_sin  # Y-coordinate of Mars relative to Sun
+        predicted_long = np.degrees(np.arctan2(mars_y, mars_x)) % 360  # Predicted longitudes in 0-360 range
+        errors = (predicted_long - self.oppositions[observations] + 180) % 360 - 180  # Smallest angle differences
+
+        points = np.broadcast_shapes(np.shape(e1), np.shape(i_s), np.shape(i_e2), np.shape(i_z))
+        self._count(int(np.prod(points)) if count_points else 0, errors.size)
+        return errors
+
+    def maxErrors(self, r, e1, i_s, i_e2, i_z, chunk=None):
+        shape = np.broadcast_shapes(np.shape(e1), np.shape(i_s), np.shape(i_e2), np.shape(i_z))  # Batch shape
+        if chunk is None:
+            chunk = max(1, BATCH_ELEMENTS // max(1, int(np.prod(shape))))  # Observations scored at once
+
+        # Keep the largest error of each parameter set, chunk by chunk like maxErrorsBatch
+        max_errors = None
+        for start in range(0, len(self.times), chunk):
+            errors = self.errors(r, e1, i_s, i_e2, i_z, slice(start, start + chunk), count_points=start == 0)
+            part = np.max(np.abs(errors), axis=-1)
+            max_errors = part if max_errors is None else np.maximum(max_errors, part)
+        return np.broadcast_to(max_errors, shape)
+
+    def stats(self):
+        return {'points': self.points, 'errors': self.errors_computed, 'transcendental_calls': self.calls,
+                'direct_transcendental_calls': self.direct_calls,
+                'calls_per_point': self.calls / self.points if self.points else 0.0,
+                'direct_calls_per_point': self.direct_calls / self.points if self.points else 0.0}
+
+"""### Early abandon
+
+The searches only care whether a parameter set beats the best max error found so far. Once one of its errors reaches that threshold, the other errors do not matter. `MarsEquantModel` and `MarsEquantModelBatch` take an optional `threshold`: they score the observations one at a time and stop scoring a parameter set at its first error that reaches the threshold. Errors that were not computed are NaN, and the max error of a dropped set is only a lower bound (it is at least the threshold). Sets that stay below the threshold get all their errors, exactly as without a threshold.
+
+`ObservationRanking` counts which observations drop parameter sets most often. Those observations are scored first next time, which drops the sets sooner. It also counts the errors that were computed and skipped.
+
+Pass `early_abandon=True` (or an `ObservationRanking`, to read its statistics afterwards) to the searches to use this. The (r, s) pairs are then searched one after another, with the best max error so far as the threshold, so early abandon cannot be combined with worker processes. The numbers of residuals computed and skipped are also added to the telemetry.
+"""
 
-    best_error = float('inf')
-    best_params = None
+class ObservationRanking:
+    def __init__(self, n_observations):
+        self.rejections = np.zeros(n_observations, dtype=np.int64)  # Parameter sets dropped by each observation
+        self.computed = 0  # Number of errors computed
+        self.skipped = 0  # Number of errors skipped
+
+    def order(self):
+        return np.argsort(-self.rejections, kind='stable')  # Most rejecting observations first
+
+    def record(self, rejected_by, computed, total):
+        self.rejections += np.bincount(np.asarray(rejected_by, dtype=np.int64), minlength=len(self.rejections))
+        self.computed += computed
+        self.skipped += total - computed
+
+    def stats(self):
+        total = self.computed + self.skipped
+        return {'computed': self.computed, 'skipped': self.skipped,
+                'skipped_fraction': self.skipped / total if total else 0.0, 'order': self.order().tolist()}
+
+def _earlyAbandonBatch(params, times, oppositions, threshold, ranking, tables=None, index=None):
+    shape = np.broadcast_shapes(*(p.shape for p in params))  # Shape of the batch of parameter sets
+    c, r, e1, e2, z, s = params
+    used = np.broadcast_arrays(r, e1, e2, z, s)  # c does not enter the errors
+    used_shape = used[0].shape  # Shape of the parameter sets that differ in something other than c
+    r, e1, e2, z, s = (p.ravel() for p in used)  # Flat parameter sets
+    ranking = ObservationRanking(len(times)) if ranking is None else ranking
+
+    # Same arithmetic as MarsEquantModelBatch, one observation at a time. With rotation tables, index holds
+    # the positions of e2 and z in the tables for every flat parameter set.
+    if tables is None:
+        e2_rad = np.radians(e2)  # Convert e2 to radians
+        z_rad = np.radians(z)  # Convert z to radians
+        equant_x, equant_y = e1 * np.cos(e2_rad), e1 * np.sin(e2_rad)  # Calculate equant coordinates
+    else:
+        i_e2, i_z = (np.broadcast_to(i, used_shape).ravel() for i in index)
+
+    errors = np.full((len(r), len(times)), np.nan)  # Errors that are not computed stay NaN
+    max_errors = np.zeros(len(r))  # Largest absolute error computed so far
+    rejected_by = np.full(len(r), -1)  # Observation that dropped each parameter set
+    alive = np.arange(len(r))  # Parameter sets still below the threshold
+    computed = 0
+
+    for i in ranking.order():
+        if len(alive) == 0:
+            break
+        if tables is None:
+            angle = z_rad[alive] + np.radians(s[alive] * times[i])  # Angle of Mars around the equant
+            mars_x = equant_x[alive] + r[alive] * np.cos(angle)  # X-coordinate of Mars relative to Sun
+            mars_y = equant_y[alive] + r[alive] * np.sin(angle)  # Y-coordinate of Mars relative to Sun
+            predicted_long = np.degrees(np.arctan2(mars_y, mars_x)) % 360  # Predicted longitudes in 0-360 range
+            error = (predicted_long - oppositions[i] + 180) % 360 - 180  # Smallest angle differences
+        else:
+            error = tables.errors(r[alive], e1[alive], 0, i_e2[alive], i_z[alive], i, count_points=computed == 0)
+        errors[alive, i] = error
+        max_errors[alive] = np.maximum(max_errors[alive], np.abs(error))
+        computed += len(alive)
+
+        # Drop the sets whose error reached the threshold
+        over = np.abs(error) >= threshold
+        rejected_by[alive[over]] = i
+        alive = alive[~over]
+
+    ranking.record(rejected_by[rejected_by >= 0], computed, errors.size)
+
+    errors = np.broadcast_to(errors.reshape(used_shape + errors.shape[-1:]), shape + errors.shape[-1:])
+    max_errors = np.broadcast_to(max_errors.reshape(used_shape), shape)
+    return errors, max_errors
+
+def earlyAbandonInnerSearch(r, s, times, oppositions, grid=None, threshold=float('inf'), ranking=None, chunk=256,
+                            telemetry=None):
+    telemetry = SearchTelemetry() if telemetry is None else telemetry  # Silent unless telemetry is given
+    grid = DEFAULT_INNER_GRID if grid is None else grid  # Use the default inner grid if none is given
+    c_range, e1_range, e2_range, z_range = grid  # Unpack the grid spec
+    times, oppositions = np.asarray(times, dtype=float), np.asarray(oppositions, dtype=float)
+
+    # c does not enter the errors, so every c gives the same errors and ties go to the first c.
+    # Only the first c is scored, in chunks of (e1, e2, z) points in grid order.
+    shape = (len(e1_range), len(e2_range), len(z_range))
+    e1, e2, z = (g.ravel() for g in np.meshgrid(e1_range, e2_range, z_range, indexing='ij'))
+    chunk = max(1, min(chunk, BATCH_ELEMENTS // len(times)))  # Keep the errors of a chunk within the memory budget
+
+    # Look up the cos and sin of e2 and of z + s t when the tables fit
+    tables = None
+    if RotationTables.fits(1, len(z_range), len(times)):
+        tables = RotationTables([s], times, oppositions, z_range, e2_range, telemetry)
+        _, e2_index, z_index = (g.ravel() for g in np.indices(shape))  # Positions of e2 and z in the tables
+
+    best_params = None  # Stays None if nothing beats the threshold
+    for start in range(0, len(e1), chunk):
+        # Score this chunk, dropping sets that cannot beat the best so far
+        part = slice(start, start + chunk)
+        params = [np.asarray(p) for p in (c_range[0], r, e1[part], e2[part], z[part], s)]
+        index = None if tables is None else (e2_index[part], z_index[part])
+        errors, max_errors = _earlyAbandonBatch(params, times, oppositions, threshold, ranking, tables, index)
+        telemetry.count(len(max_errors) * len(c_range))  # Every c shares these errors
+        j = np.argmin(max_errors)  # First smallest max error in the chunk
+        if max_errors[j] < threshold:
+            threshold = max_errors[j]
+            i_e1, i_e2, i_z = np.unravel_index(start + j, shape)
+            best_params = (c_range[0], e1_range[i_e1], e2_range[i_e2], z_range[i_z], errors[j].copy(), max_errors[j])
+
+    return best_params  # (c, e1, e2, z, errors, max_error) or None
+
+"""### Cache of inner search results
+
+The outer searches run the inner search for many (r, s) pairs, and the same pairs come back when a search is repeated or when another search visits them. `InnerSearchCache` keeps the best (c, e1, e2, z, errors, max_error) of each inner search, keyed by the quantized (r, s), the grid spec, a fingerprint of the dataset and the name of the compute backend. It holds at most `maxsize` results and at most `maxbytes` bytes of errors (every result holds the errors of all the observations, so with large datasets the bytes are the limit), and evicts the least recently used results first. `stats()` reports how many searches were served from the cache.
+"""
 
-    for r in r_range:
-        c, e1, e2, z, errors, max_error = bestOrbitInnerParams(r, s_fixed, times, oppositions)
+from collections import OrderedDict  # Import OrderedDict for the LRU order
+
+KEY_DIGITS = 12  # r and s are rounded to this many decimals in cache keys
+
+def datasetFingerprint(times, oppositions):
+    digest = hashlib.sha1()  # Hash of the observations
+    for values in (times, oppositions):
+        digest.update(np.ascontiguousarray(values, dtype=float).tobytes())  # Add the raw float64 values
+    return digest.hexdigest()
+
+def gridKey(grid=None):
+    grid = DEFAULT_INNER_GRID if grid is None else grid  # Use the default inner grid if none is given
+    digest = hashlib.sha1()  # Hash of the grid spec
+    for values in grid:
+        values = np.ascontiguousarray(values)
+        digest.update(f'{values.dtype.str}{values.shape}'.encode())  # Add the type and length of the range
+        digest.update(values.tobytes())  # Add the values of the range
+    return digest.hexdigest()
+
+class InnerSearchCache:
+    def __init__(self, maxsize=4096, maxbytes=64 * 2 ** 20):
+        self.maxsize = maxsize  # Largest number of results kept
+        self.maxbytes = maxbytes  # Largest number of bytes of errors kept
+        self.nbytes = 0  # Bytes of errors kept
+        self.hits = 0  # Number of lookups served from the cache
+        self.misses = 0  # Number of lookups that had to be searched
+        self.evictions = 0  # Number of results dropped to make room
+        self._results = OrderedDict()  # Results, least recently used first
+
+    @staticmethod
+    def key(r, s, spec, fingerprint):
+        # The backend is part of the key, since backends can differ in the last bits and so break ties differently
+        return round(float(r), KEY_DIGITS), round(float(s), KEY_DIGITS), spec, fingerprint, compute_backend.name
+
+    def get(self, key):
+        result = self._results.get(key)  # Look up the result
+        if result is None:
+            self.misses += 1
+            return None
+        self._results.move_to_end(key)  # Mark the result as most recently used
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        old = self._results.pop(key, None)
+        if old is not None:
+            self.nbytes -= old[4].nbytes  # The result is replaced
+        self._results[key] = result  # Store the result as the most recently used
+        self.nbytes += result[4].nbytes
+        while self._results and (len(self._results) > self.maxsize or self.nbytes > self.maxbytes):
+            _, dropped = self._results.popitem(last=False)  # Drop the least recently used result
+            self.nbytes -= dropped[4].nbytes
+            self.evictions += 1
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'size': len(self._results), 'maxsize': self.maxsize, 'nbytes': self.nbytes,
+                'maxbytes': self.maxbytes}
+
+    def clear(self):
+        self._results.clear()  # Drop all results
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0  # Reset the statistics
+
+inner_search_cache = InnerSearchCache()  # Cache shared by all the searches below
+
+"""### Search a grid of (r, s) candidates
+
+`searchOrbitGrid` is the common core of all the searches below. It gets the best inner parameters of every (r, s) pair, from the cache or from `innerSearches`, and keeps the pair with the smallest max error. `innerSearches` scores all the s values of an r and the whole inner grid in one batched call.
+
+Ties go to the first parameter set in (r, s, c, e1, e2, z) order, which is the same choice the nested loops made, so the best parameters do not change.
+"""
 
+def innerSearches(pairs, times, oppositions, grid=None, telemetry=None):
+    grid = DEFAULT_INNER_GRID if grid is None else grid  # Use the default inner grid if none is given
+    telemetry = SearchTelemetry() if telemetry is None else telemetry  # Silent unless telemetry is given
+    c_range, e1_range, e2_range, z_range = grid  # Unpack the grid spec
+    c, e1, e2, z = innerGrid(grid)  # Open mesh over the inner grid
+
+    # Group the pairs by r so that all the s values of an r are scored together
+    positions_by_r = {}
+    for i, (r, s) in enumerate(pairs):
+        positions_by_r.setdefault(r, []).append(i)
+
+    # The cos and sin tables of the s values are shared by all r values
+    s_values = list(dict.fromkeys(s for _, s in pairs))  # Distinct s values in order
+    tables = None
+    if compute_backend.tables and RotationTables.fits(len(s_values), len(z_range), len(times)):
+        tables = RotationTables(s_values, times, oppositions, z_range, e2_range, telemetry)
+
+    results = [None] * len(pairs)  # (c, e1, e2, z, errors, max_error) of each pair
+    for r, positions in positions_by_r.items():
+        s_col = np.array([pairs[i][1] for i in positions]).reshape(-1, 1, 1, 1, 1)  # s in front of (c, e1, e2, z)
+
+        # Score every (s, c, e1, e2, z) combination for this r at once
+        if tables is None:
+            max_errors = maxErrorsBatch(c, r, e1, e2, z, s_col, times, oppositions)
+        else:
+            i_s = np.array([s_values.index(pairs[i][1]) for i in positions]).reshape(-1, 1, 1, 1)
+            i_e2, i_z = np.ix_(range(len(e2_range)), range(len(z_range)))
+            max_errors = tables.maxErrors(r, e1_range.reshape(-1, 1, 1), i_s, i_e2, i_z)  # Axes (s, e1, e2, z)
+            full_shape = (len(positions), len(c_range)) + max_errors.shape[1:]  # Axes (s, c, e1, e2, z)
+            max_errors = np.broadcast_to(max_errors[:, np.newaxis], full_shape)
+        best = np.argmin(max_errors.reshape(len(positions), -1), axis=1)  # First smallest max error for each s
+        telemetry.count(max_errors.size)
+
+        for k, i in enumerate(positions):
+            i_c, i_e1, i_e2, i_z = np.unravel_index(best[k], max_errors.shape[1:])
+            params = (c_range[i_c], e1_range[i_e1], e2_range[i_e2], z_range[i_z])
+            errors, _ = MarsEquantModelBatch(params[0], r, params[1], params[2], params[3], s_col[k, 0, 0, 0, 0],
+                                             times, oppositions)  # Errors of the best point
+            results[i] = (*params, errors, max_errors[k, i_c, i_e1, i_e2, i_z])
+
+    return results
+
+def searchOrbitGrid(r_values, s_values, times, oppositions, grid=None, workers=None, cache=inner_search_cache,
+                    early_abandon=None, telemetry=None, memory_budget=None, checkpoint=None, resume=False,
+                    landscape=None):
+    grid = DEFAULT_INNER_GRID if grid is None else grid  # Use the default inner grid if none is given
+    telemetry = SearchTelemetry() if telemetry is None else telemetry  # Silent unless telemetry is given
+    pairs = [(r, s) for r in np.atleast_1d(r_values) for s in np.atleast_1d(s_values)]  # (r, s) candidates in order
+    if checkpoint is not None and (early_abandon or (workers is not None and workers > 1)):
+        raise ValueError("Checkpoints need the serial tiled search, without workers or early abandon")
+    if landscape is not None and (early_abandon or (workers is not None and workers > 1)):
+        raise ValueError("Landscapes need the serial tiled search, without workers or early abandon")
+    if early_abandon and workers is not None and workers > 1:
+        raise ValueError("Early abandon searches the pairs one by one, without workers")
+
+    # Look up the pairs that were searched before. A checkpointed search searches all the pairs, so
+    # that the pairs of the checkpoint do not depend on what is in the cache, and so does a landscape.
+    results = [None] * len(pairs)
+    if cache is not None:
+        spec, fingerprint = gridKey(grid), datasetFingerprint(times, oppositions)
+        keys = [cache.key(r, s, spec, fingerprint) for r, s in pairs]
+        if checkpoint is None and landscape is None:
+            results = [cache.get(key) for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+
+    # Search the other pairs, serially or on a process pool. With early abandon
+    # they are searched one by one in the loop below instead.
+    if missing and not early_abandon:
+        missing_pairs = [pairs[i] for i in missing]
+        if workers is not None and workers > 1:
+            found = parallelInnerSearches(missing_pairs, times, oppositions, grid, workers, telemetry)
+        elif memory_budget is not None or checkpoint is not None or landscape is not None:
+            # Score the grids in tiles that fit in the memory budget
+            memory_budget = DEFAULT_MEMORY_BUDGET if memory_budget is None else memory_budget
+            if isinstance(landscape, str):
+                landscape = createErrorLandscape(landscape, r_values, s_values, times, oppositions, grid,
+                                                 resume=resume)
+            found = searchGridTiles(missing_pairs, times, oppositions, grid, memory_budget, telemetry=telemetry,
+                                    checkpoint=checkpoint, resume=resume, landscape=landscape)[0]
+        else:
+            found = innerSearches(missing_pairs, times, oppositions, grid, telemetry)
+        for i, result in zip(missing, found):
+            results[i] = result
+            if cache is not None:
+                cache.put(keys[i], result)
+
+    ranking = early_abandon if isinstance(early_abandon, ObservationRanking) else ObservationRanking(len(times))
+    computed, skipped = ranking.computed, ranking.skipped  # A ranking that is passed in may have counts already
+    best_error = float('inf')  # Initialize best error to infinity
+    best_params = None  # Initialize best parameters
+
+    for i, (r, s) in enumerate(pairs):
+        if results[i] is None:
+            # Early abandon: only look for points that beat the best pair so far
+            results[i] = earlyAbandonInnerSearch(r, s, times, oppositions, grid, best_error, ranking,
+                                                 telemetry=telemetry)
+            if results[i] is None:
+                continue  # Nothing in this pair beats the best so far
+            if cache is not None:
+                cache.put(keys[i], results[i])
+
+        # Update best parameters if this pair gives a lower error
+        c, e1, e2, z, errors, max_error = results[i]
         if max_error < best_error:
             best_error = max_error
-            best_params = (r, errors, max_error)
+            best_params = (r, s, c, e1, e2, z, errors.copy(), max_error)
+            telemetry.best(max_error)
+
+    telemetry.residuals(ranking.computed - computed, ranking.skipped - skipped)
+    return best_params  # (r, s, c, e1, e2, z, errors, max_error)
+
+"""### Running the (r, s) sweep on a process pool
+
+Every (r, s) candidate is independent work, so `parallelInnerSearches` hands them out to a pool of worker processes. When there are fewer candidates than workers, each candidate's inner grid is also cut into tiles along the e2 axis.
 
-        print(f"Debug: r={r:.6f}, max_error={max_error:.4f}, best_overall_max_error={best_error:.4f}")
+`times` and `oppositions` are sent to each worker once, when the worker starts, and not with every task. Each task returns its smallest max error together with its position in the inner grid. Ties between tiles are broken on that position, so the result is the same as a serial run no matter which worker finishes first.
+"""
+
+_worker_data = None  # (times, oppositions) of the current worker process
+
+def _workerData(times, oppositions):
+    # Workers map the cache file of loadOppositions instead of receiving a copy of the data
+    filename = getattr(times, 'filename', None)
+    if filename is not None and getattr(oppositions, 'filename', None) == filename:
+        data = np.load(filename, mmap_mode='r')
+        if data.shape == (2, len(times)) and np.array_equal(data[0], times) and np.array_equal(data[1], oppositions):
+            return (filename,)
+    return (np.asarray(times), np.asarray(oppositions))
+
+def _initSearchWorker(backend, *data):
+    global _worker_data
+    # The backend of the parent process, which checked it. The workers already run in parallel, so one thread each.
+    selectBackend(backend, check=False, threads=1)
+    if len(data) == 1:
+        data = tuple(np.load(data[0], mmap_mode='r'))  # Map the cache file
+    _worker_data = data  # Keep the observations for all tasks of this worker
+
+def _searchTask(task):
+    i, r, s, grid, e2_start = task  # Unpack the task
+    times, oppositions = _worker_data  # Observations sent when the worker started
+    c, e1, e2, z = innerGrid(grid)  # Open mesh over this tile of the inner grid
+    max_errors = maxErrorsBatch(c, r, e1, e2, z, s, times, oppositions)
+    i_c, i_e1, i_e2, i_z = np.unravel_index(np.argmin(max_errors), max_errors.shape)  # First smallest max error
+    index = (i_c, i_e1, e2_start + i_e2, i_z)  # Position in the full inner grid
+    errors, _ = MarsEquantModelBatch(c[i_c, 0, 0, 0], r, e1[0, i_e1, 0, 0], e2[0, 0, i_e2, 0], z[0, 0, 0, i_z], s,
+                                     times, oppositions)  # Errors of the best point
+    return i, max_errors[i_c, i_e1, i_e2, i_z], index, errors
+
+def parallelInnerSearches(pairs, times, oppositions, grid=None, workers=2, telemetry=None):
+    grid = DEFAULT_INNER_GRID if grid is None else grid  # Use the default inner grid if none is given
+    telemetry = SearchTelemetry() if telemetry is None else telemetry  # Silent unless telemetry is given
+    c_range, e1_range, e2_range, z_range = grid  # Unpack the grid spec
+
+    # Split the e2 axis into tiles when there are fewer (r, s) candidates than workers
+    n_tiles = min(len(e2_range), -(-workers // len(pairs)))
+    bounds = np.linspace(0, len(e2_range), n_tiles + 1).astype(int)  # Tile edges along e2
+    tasks = [(i, r, s, (c_range, e1_range, e2_range[a:b], z_range), a)
+             for i, (r, s) in enumerate(pairs) for a, b in zip(bounds[:-1], bounds[1:])]
+
+    from concurrent.futures import ProcessPoolExecutor  # Imported here because it is slow to import
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_initSearchWorker,
+                             initargs=(compute_backend.name,) + _workerData(times, oppositions)) as pool:
+        tiles = []
+        for tile in pool.map(_searchTask, tasks):
+            tiles.append(tile)
+            telemetry.count(len(c_range) * len(e1_range) * len(e2_range) * len(z_range) / n_tiles)
+
+    # Smallest max error of each pair, ties broken by position in the inner grid like the serial search
+    best = {}
+    for i, max_error, index, errors in tiles:
+        if i not in best or (max_error, index) < best[i][:2]:
+            best[i] = (max_error, index, errors)
+
+    results = []
+    for i in range(len(pairs)):
+        max_error, (i_c, i_e1, i_e2, i_z), errors = best[i]
+        results.append((c_range[i_c], e1_range[i_e1], e2_range[i_e2], z_range[i_z], errors, max_error))
+    return results
+
+"""### Tiled grid search with a memory budget
+
+The searches above score the whole inner grid of an (r, s) pair at once, which needs memory for every (e1, e2, z) point. That is fine for the default grid but not for fine grids: at 1 degree and an e1 step of 0.005 the inner grid of one pair has 5 million points. `tiledGridSearch` cuts the grid into tiles that fit in `memory_budget` bytes and scores them one by one:
+
+- `tileBlock` picks the shape of the tiles: all (e1, e2, z) points of a pair, halved along the longest axis until the errors of a tile and its rotation tables fit in the budget. The observations are then scored in chunks that fill the budget. `gridTiles` yields the tiles of each pair in a fixed order.
+- `evaluateGridTiles` is a generator that scores one tile at a time and yields its max errors with the time it took, so memory does not grow with the number of tiles.
+- `GridReduction` keeps what is needed from the tiles: the best point of every pair and a running top k over all pairs. Ties go to the first point in (r, s, c, e1, e2, z) order, as in the other searches.
+
+`tiledGridSearch` returns the best (c, e1, e2, z, errors, max_error) of every pair, the top k (r, s, c, e1, e2, z, errors, max_error) and statistics with the points per second of every tile. `searchGridTiles` does the same for a list of (r, s) pairs. Pass `memory_budget=` to the searches to use it.
+
+With `dtype=np.float32` the tables and errors are computed in single precision, which halves the memory per point. The max errors are then only accurate to about 1e-5 degrees, so the best points are rescored in double precision at the end, but a near tie can go to a different point than in double precision.
+"""
+
+DEFAULT_MEMORY_BUDGET = 64 * 2 ** 20  # Default memory budget of the tiled search in bytes
+TILE_TEMPORARIES = 8  # Arrays of the size of the errors that the model needs at once
+TILE_OBSERVATIONS = 256  # Observations a tile should hold at once before the observations are chunked
+
+def tileBlock(grid, n_observations, memory_budget=DEFAULT_MEMORY_BUDGET, itemsize=8):
+    c_range, e1_range, e2_range, z_range = grid  # Unpack the grid spec
+    elements = max(1, int(memory_budget) // (TILE_TEMPORARIES * itemsize))  # Errors that fit in the budget
+
+    # Halve the longest axis of the tile until its points fit with enough observations
+    block = [len(e1_range), len(e2_range), len(z_range)]
+    max_points = max(1, elements // min(n_observations, TILE_OBSERVATIONS))
+    while np.prod(block) > max_points:
+        k = int(np.argmax(block))
+        block[k] = -(-block[k] // 2)
+    return block  # (e1, e2, z) points in a tile
+
+def gridTiles(pairs, grid, block):
+    c_range, e1_range, e2_range, z_range = grid  # Unpack the grid spec
+
+    # Tiles of each pair in grid order, z outermost so that a rotation table serves all tiles of a z block
+    for i, (r, s) in enumerate(pairs):
+        for z_start in range(0, len(z_range), block[2]):
+            for e1_start in range(0, len(e1_range), block[0]):
+                for e2_start in range(0, len(e2_range), block[1]):
+                    yield i, (slice(e1_start, e1_start + block[0]), slice(e2_start, e2_start + block[1]),
+                              slice(z_start, z_start + block[2]))
+
+def evaluateGridTiles(pairs, times, oppositions, grid=None, memory_budget=DEFAULT_MEMORY_BUDGET, dtype=np.float64,
+                      telemetry=None, block=None, skip=0):
+    grid = DEFAULT_INNER_GRID if grid is None else grid  # Use the default inner grid if none is given
+    telemetry = SearchTelemetry() if telemetry is None else telemetry  # Silent unless telemetry is given
+    c_range, e1_range, e2_range, z_range = grid  # Unpack the grid spec
+    times, oppositions = np.asarray(times, dtype=float), np.asarray(oppositions, dtype=float)
+    itemsize = np.dtype(dtype).itemsize
+    elements = max(1, int(memory_budget) // (TILE_TEMPORARIES * itemsize))  # Errors that fit in the budget
+    block = tileBlock(grid, len(times), memory_budget, itemsize) if block is None else block
+
+    tables, table_key = None, None  # Rotation tables of the current (pair, z block)
+    for number, (i, (e1_part, e2_part, z_part)) in enumerate(gridTiles(pairs, grid, block)):
+        if number < skip:
+            continue  # Finished before the search was resumed
+        start = time.perf_counter()
+        r, s = pairs[i]
+        e1, e2, z = e1_range[e1_part], e2_range[e2_part], z_range[z_part]  # Values in this tile
+        points = len(e1) * len(e2) * len(z)  # Parameter sets scored (c does not enter the errors)
+        chunk = max(1, elements // points)  # Observations scored at once
+
+        if len(z) * len(times) <= elements and (i, z_part.start) != table_key:
+            tables = RotationTables([s], times, oppositions, z, e2_range, telemetry, dtype)  # Tables of this z block
+            table_key = (i, z_part.start)
+        if table_key == (i, z_part.start):
+            i_e2, i_z = np.ix_(range(e2_part.start, e2_part.start + len(e2)), range(len(z)))
+            max_errors = tables.maxErrors(r, e1.reshape(-1, 1, 1), 0, i_e2, i_z, chunk)
+        else:
+            max_errors = maxErrorsBatch(0, r, *np.ix_(e1, e2, z), s, times, oppositions, chunk)
+
+        seconds = time.perf_counter() - start
+        telemetry.count(points * len(c_range))  # Every c shares these errors
+        yield {'number': number, 'pair': i, 'tile': (e1_part, e2_part, z_part), 'max_errors': max_errors,
+               'points': points, 'seconds': seconds,
+               'points_per_second': points / seconds if seconds > 0 else float('inf')}
+
+class GridReduction:
+    def __init__(self, n_pairs, grid, k=1):
+        self.k = k  # Number of points kept over all pairs
+        self.shape = tuple(len(g) for g in grid[1:])  # (e1, e2, z) shape of the inner grid
+        self.best = [None] * n_pairs  # (max_error, flat index) of the best point of each pair
+        self.top_errors = np.empty(0)  # Max errors of the top k points
+        self.top_index = np.empty((0, 2), dtype=np.int64)  # (pair, flat index) of the top k points
+
+    def update(self, pair, tile, max_errors):
+        # Flat (e1, e2, z) grid index of every point of the tile, in grid order
+        ranges = [np.arange(part.start, part.start + n) for part, n in zip(tile, max_errors.shape)]
+        flat = np.ravel_multi_index(np.ix_(*ranges), self.shape).ravel()
+        errors = np.asarray(max_errors).ravel()
+
+        # Best point of the pair: smallest max error, then first in grid order
+        order = np.lexsort((flat, errors))
+        j = order[0]
+        if self.best[pair] is None or (errors[j], flat[j]) < self.best[pair]:
+            self.best[pair] = (errors[j], flat[j])
+
+        # Top k over all pairs, also in grid order on ties
+        order = order[:self.k]
+        top_errors = np.concatenate([self.top_errors, errors[order]])
+        top_index = np.concatenate([self.top_index, np.column_stack([np.full(len(order), pair), flat[order]])])
+        keep = np.lexsort((top_index[:, 1], top_index[:, 0], top_errors))[:self.k]
+        self.top_errors, self.top_index = top_errors[keep], top_index[keep]
+
+    def state(self):
+        # Plain Python values that round trip exactly through JSON
+        return {'best': [None if best is None else [float(best[0]), int(best[1])] for best in self.best],
+                'top_errors': self.top_errors.tolist(), 'top_index': self.top_index.tolist()}
+
+    def restore(self, state):
+        self.best = [None if best is None else (np.float64(best[0]), np.int64(best[1])) for best in state['best']]
+        self.top_errors = np.array(state['top_errors'], dtype=float)
+        self.top_index = np.array(state['top_index'], dtype=np.int64).reshape(-1, 2)
+
+"""### Checkpoints
+
+A tiled search of a fine grid can run for hours. With `checkpoint='file.json'`, `tiledGridSearch` writes its state to that file every `checkpoint_interval` seconds and when it finishes: the number of tiles finished (tiles are scored in a fixed order, so they are a prefix of the tiles), the tile shape, the `GridReduction` state with the best point of every pair and the top k, and the best (r, s, c, e1, e2, z, max_error) so far. The file is written to a temporary file first and then renamed over the old one, so a killed process leaves either the old or the new checkpoint, never a half written one.
+
+With `resume=True` the search starts from the checkpoint instead of from scratch, with the tile shape of the checkpoint. It refuses (with a `ValueError`) when the dataset fingerprint or the grid spec (the (r, s) pairs, the inner grid, k and the dtype) are not those of the checkpoint, because the finished tiles would then belong to another search. A checkpoint of a search with a landscape also records the path of the landscape and the number of tiles written to it. Resuming with a landscape skips the finished tiles only when it is that landscape and it holds them, and refuses otherwise. A new landscape, with no tiles written yet, is filled by scoring all the tiles again. `bestMarsOrbitParams` and `searchOrbitGrid` take the same options.
+"""
+
+import json  # Import json for the checkpoint files
+
+CHECKPOINT_VERSION = 1  # Change when the checkpoint format changes
+CHECKPOINT_TOP = 10  # Best points the tiles command keeps in its checkpoints
+
+def _writeAtomically(path, write):
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as file:
+        write(file)
+        file.flush()
+        os.fsync(file.fileno())  # Make sure the data is on disk before the rename
+    os.replace(temporary, path)  # Other processes never see a half written file
+
+def checkpointSpec(pairs, grid, k, dtype):
+    digest = hashlib.sha1(gridKey(grid).encode())  # Hash of the search
+    digest.update(np.asarray(pairs, dtype=float).tobytes())  # Add the (r, s) pairs
+    digest.update(f'{k}:{np.dtype(dtype).name}'.encode())  # Add k and the dtype
+    return digest.hexdigest()
+
+def loadCheckpoint(path, fingerprint, spec):
+    with open(path) as file:
+        state = json.load(file)
+    if state.get('version') != CHECKPOINT_VERSION:
+        raise ValueError(f"Checkpoint {path} has format version {state.get('version')}, not {CHECKPOINT_VERSION}")
+    if state['dataset'] != fingerprint:
+        raise ValueError(f"Checkpoint {path} was written for another dataset, refusing to resume")
+    if state['grid'] != spec:
+        raise ValueError(f"Checkpoint {path} was written for another grid spec, refusing to resume")
+    return state
+
+def tiledGridSearch(r_values, s_values, times, oppositions, grid=None, memory_budget=DEFAULT_MEMORY_BUDGET, k=1,
+                    dtype=np.float64, telemetry=None, checkpoint=None, checkpoint_interval=60.0, resume=False,
+                    landscape=None):
+    pairs = [(r, s) for r in np.atleast_1d(r_values) for s in np.atleast_1d(s_values)]  # (r, s) candidates in order
+    if isinstance(landscape, str):
+        landscape = createErrorLandscape(landscape, r_values, s_values, times, oppositions, grid, dtype, resume)
+    return searchGridTiles(pairs, times, oppositions, grid, memory_budget, k, dtype, telemetry, checkpoint,
+                           checkpoint_interval, resume, landscape)
+
+def searchGridTiles(pairs, times, oppositions, grid=None, memory_budget=DEFAULT_MEMORY_BUDGET, k=1,
+                    dtype=np.float64, telemetry=None, checkpoint=None, checkpoint_interval=60.0, resume=False,
+                    landscape=None):
+    grid = DEFAULT_INNER_GRID if grid is None else grid  # Use the default inner grid if none is given
+    telemetry = SearchTelemetry() if telemetry is None else telemetry  # Silent unless telemetry is given
+    c_range, e1_range, e2_range, z_range = grid  # Unpack the grid spec
+    reduction = GridReduction(len(pairs), grid, k)
+
+    def params(pair, flat):
+        # Errors of a point, recomputed in double precision
+        r, s = pairs[pair]
+        i_e1, i_e2, i_z = np.unravel_index(flat, reduction.shape)
+        c, e1, e2, z = c_range[0], e1_range[i_e1], e2_range[i_e2], z_range[i_z]
+        errors, max_error = MarsEquantModelBatch(c, r, e1, e2, z, s, times, oppositions)
+        return r, s, c, e1, e2, z, errors, max_error[()]
+
+    # Continue from the checkpoint if asked to and there is one
+    block = tileBlock(grid, len(times), memory_budget, np.dtype(dtype).itemsize)
+    done = 0  # Tiles finished
+    landscape_path = None if landscape is None else os.path.realpath(landscape.path)
+    if checkpoint is not None:
+        fingerprint, spec = datasetFingerprint(times, oppositions), checkpointSpec(pairs, grid, k, dtype)
+        if resume and os.path.exists(checkpoint):
+            state = loadCheckpoint(checkpoint, fingerprint, spec)
+            block = state['block']
+            if landscape is not None and state['tiles_done'] and landscape.meta['tiles_written'] == 0:
+                pass  # A new landscape needs every tile, so score them all again (in the tiles of the checkpoint)
+            else:
+                # The finished tiles are skipped, so the landscape must already hold them
+                if landscape is not None and ((state.get('landscape') or {}).get('path') != landscape_path or
+                                              landscape.meta['tiles_written'] < state['tiles_done']):
+                    raise ValueError(f"Landscape {landscape.path} does not hold the {state['tiles_done']} tiles "
+                                     f"finished in checkpoint {checkpoint}, refusing to resume")
+                done = state['tiles_done']
+                reduction.restore(state['reduction'])
+    resumed = done
+
+    def save(finished):
+        best = None
+        if len(reduction.top_index):
+            r, s, c, e1, e2, z, _, max_error = params(*reduction.top_index[0])
+            best = [float(v) for v in (r, s, c, e1, e2, z, max_error)]
+        state = {'version': CHECKPOINT_VERSION, 'dataset': fingerprint, 'grid': spec, 'block': [int(b) for b in block],
+                 'tiles_done': done, 'finished': finished, 'best': best, 'reduction': reduction.state()}
+        if landscape is not None:
+            state['landscape'] = {'path': landscape_path, 'tiles_written': landscape.meta['tiles_written']}
+        _writeAtomically(checkpoint, lambda file: file.write(json.dumps(state).encode()))
+
+    # Score the tiles one at a time, keeping only the reduction state
+    tile_rates = []  # Points per second of each tile
+    evaluated = 0  # Parameter sets scored in this run
+    start = last_save = time.perf_counter()
+    for tile in evaluateGridTiles(pairs, times, oppositions, grid, memory_budget, dtype, telemetry, block, done):
+        reduction.update(tile['pair'], tile['tile'], tile['max_errors'])
+        if landscape is not None:
+            landscape.write(tile['pair'], tile['tile'], tile['max_errors'])  # Stream the tile to disk
+        tile_rates.append(tile['points_per_second'])
+        evaluated += tile['points']
+        done = tile['number'] + 1
+        if checkpoint is not None and time.perf_counter() - last_save >= checkpoint_interval:
+            if landscape is not None:
+                landscape.flush()  # The landscape holds every tile the checkpoint counts
+            save(False)
+            last_save = time.perf_counter()
+    seconds = time.perf_counter() - start
+    if landscape is not None:
+        landscape.flush(complete=True)
+    if checkpoint is not None:
+        save(True)
+
+    results = [params(i, flat)[2:] for i, (_, flat) in enumerate(reduction.best)]  # (c, e1, e2, z, errors, max_error)
+    top = [params(pair, flat) for pair, flat in reduction.top_index]
+    top.sort(key=lambda candidate: candidate[7])  # Best first in double precision, stable on ties
+    if top:
+        telemetry.best(top[0][7])
+
+    stats = {'tiles': len(tile_rates), 'resumed_tiles': resumed, 'points': evaluated, 'seconds': seconds,
+             'points_per_second': evaluated / seconds if seconds > 0 else float('inf'),
+             'tile_points_per_second': tile_rates}
+    return results, top, stats
+
+"""### Error landscapes
+
+The searches keep only the best point of every (r, s) pair. To study the shape of the max error around the optimum (how sensitive it is to each parameter, where the ridges are) without scoring the model again, pass `landscape='directory'` to `bestMarsOrbitParams`, `bestOrbitInnerParams`, `searchOrbitGrid` or `tiledGridSearch`. The search then runs tiled, and `createErrorLandscape` stores the max error of every grid point in that directory:
+
+- `max_errors.npy` is a memory-mapped array with axes (r, s, e1, e2, z). c does not enter the errors, so it is not stored. The queries below repeat the errors along c.
+- `axes.json` holds the values along the r, s, c, e1, e2 and z axes, the dataset fingerprint, the dtype, and whether the search finished.
+
+Every tile is written into the memory map as soon as it is scored, so the landscape can be larger than memory. Points that were not scored yet are NaN. With a checkpoint, the landscape is flushed before each checkpoint is saved. With `resume=True`, the search continues in the existing landscape, as long as it belongs to the same dataset and grid.
+
+`ErrorLandscape(directory)` opens a landscape read-only. Its queries take a box, with one keyword per axis: a `(low, high)` range of values, a single value, or nothing for the whole axis.
+
+- `slice(**box)` returns the max errors in the box, with axes (r, s, c, e1, e2, z), and the axis values of the box.
+- `top(k, **box)` returns the k points with the smallest max error in the box as (r, s, c, e1, e2, z, max_error), ties going to the first point in grid order as in the searches.
+- `argmin(**box)` returns the first of them.
+
+The queries read the memory map in blocks of at most `BATCH_ELEMENTS` points, so they work on landscapes larger than memory too.
+"""
+
+LANDSCAPE_VERSION = 1  # Change when the landscape format changes
+LANDSCAPE_AXES = ('r', 's', 'c', 'e1', 'e2', 'z')  # Axes of a landscape, c is not stored
+LANDSCAPE_TOLERANCE = 1e-9  # Relative slack when a query selects axis values
+
+class ErrorLandscape:
+    def __init__(self, path, mode='r'):
+        self.path = path  # Directory of the landscape
+        with open(os.path.join(path, 'axes.json')) as file:
+            self.meta = json.load(file)
+        if self.meta.get('version') != LANDSCAPE_VERSION:
+            raise ValueError(f"Landscape {path} has format version {self.meta.get('version')}, not {LANDSCAPE_VERSION}")
+        self.axes = {name: np.array(self.meta['axes'][name]) for name in LANDSCAPE_AXES}  # Values along every axis
+        self.max_errors = np.load(os.path.join(path, 'max_errors.npy'), mmap_mode=mode)  # Axes (r, s, e1, e2, z)
+        self.shape = tuple(len(self.axes[name]) for name in LANDSCAPE_AXES)  # Shape with the c axis
+
+    def write(self, pair, tile, max_errors):
+        i_r, i_s = divmod(pair, len(self.axes['s']))  # Pairs are in (r, s) order
+        self.max_errors[(i_r, i_s) + tuple(tile)] = max_errors
+        self.meta['tiles_written'] += 1
+
+    def flush(self, complete=False):
+        self.max_errors.flush()  # The errors are on disk before the metadata says so
+        self.meta['complete'] = complete
+        _writeAtomically(os.path.join(self.path, 'axes.json'), lambda file: file.write(json.dumps(self.meta).encode()))
+
+    def _box(self, box):
+        # Index slice of every axis. The axis values are sorted, so the values in a range are contiguous.
+        parts = []
+        for name in LANDSCAPE_AXES:
+            values, bounds = self.axes[name], box.pop(name, None)
+            if bounds is None:
+                parts.append(slice(0, len(values)))
+                continue
+            low, high = (bounds, bounds) if np.isscalar(bounds) else bounds
+            inside = np.flatnonzero((values >= low - LANDSCAPE_TOLERANCE * abs(low)) &
+                                    (values <= high + LANDSCAPE_TOLERANCE * abs(high)))
+            if len(inside) == 0:
+                raise ValueError(f"No {name} value in [{low}, {high}]")
+            parts.append(slice(inside[0], inside[-1] + 1))
+        if box:
+            raise ValueError(f"Unknown axes {', '.join(box)}, the axes are {', '.join(LANDSCAPE_AXES)}")
+        return parts
+
+    def slice(self, **box):
+        parts = self._box(box)
+        i_r, i_s, i_c, i_e1, i_e2, i_z = parts
+        errors = np.array(self.max_errors[i_r, i_s, i_e1, i_e2, i_z])  # Read from disk
+        shape = errors.shape[:2] + (i_c.stop - i_c.start,) + errors.shape[2:]
+        errors = np.broadcast_to(errors[:, :, np.newaxis], shape)  # The same errors for every c
+        return errors, {name: self.axes[name][part] for name, part in zip(LANDSCAPE_AXES, parts)}
+
+    def top(self, k=1, **box):
+        i_r, i_s, i_c, i_e1, i_e2, i_z = self._box(box)
+        n_e1 = max(1, BATCH_ELEMENTS // ((i_e2.stop - i_e2.start) * (i_z.stop - i_z.start)))  # e1 values per block
+
+        # Running top k over blocks of the box, in grid order
+        top_errors, top_index = np.empty(0), np.empty(0, dtype=np.int64)
+        for r_index in range(i_r.start, i_r.stop):
+            for s_index in range(i_s.start, i_s.stop):
+                for e1_start in range(i_e1.start, i_e1.stop, n_e1):
+                    e1_part = slice(e1_start, min(e1_start + n_e1, i_e1.stop))
+                    errors = np.asarray(self.max_errors[r_index, s_index, e1_part, i_e2, i_z], dtype=float).ravel()
+                    ranges = [[r_index], [s_index], range(e1_part.start, e1_part.stop),
+                              range(i_e2.start, i_e2.stop), range(i_z.start, i_z.stop)]
+                    flat = np.ravel_multi_index(np.ix_(*ranges), self.max_errors.shape).ravel()
+                    scored = ~np.isnan(errors)  # Points not scored yet are left out
+                    errors, flat = np.concatenate([top_errors, errors[scored]]), np.concatenate([top_index, flat[scored]])
+                    keep = np.lexsort((flat, errors))[:k]  # Smallest max error, then grid order
+                    top_errors, top_index = errors[keep], flat[keep]
+
+        c = self.axes['c'][i_c.start]  # Ties go to the first c
+        points = []
+        for max_error, index in zip(top_errors, top_index):
+            r_index, s_index, e1_index, e2_index, z_index = np.unravel_index(index, self.max_errors.shape)
+            points.append((self.axes['r'][r_index], self.axes['s'][s_index], c, self.axes['e1'][e1_index],
+                           self.axes['e2'][e2_index], self.axes['z'][z_index], max_error))
+        return points
+
+    def argmin(self, **box):
+        top = self.top(1, **box)
+        if not top:
+            raise ValueError("No scored point in the box")
+        return top[0]
+
+def createErrorLandscape(path, r_values, s_values, times, oppositions, grid=None, dtype=np.float64, resume=False):
+    grid = DEFAULT_INNER_GRID if grid is None else grid  # Use the default inner grid if none is given
+    values = [np.atleast_1d(r_values), np.atleast_1d(s_values)] + [np.asarray(g) for g in grid]
+    axes = json.loads(json.dumps({name: v.tolist() for name, v in zip(LANDSCAPE_AXES, values)}))  # As in axes.json
+    fingerprint = datasetFingerprint(times, oppositions)
+
+    # Continue in an existing landscape of the same search
+    if resume and os.path.exists(os.path.join(path, 'axes.json')):
+        landscape = ErrorLandscape(path, 'r+')
+        if landscape.meta['dataset'] != fingerprint or landscape.meta['axes'] != axes:
+            raise ValueError(f"Landscape {path} was written for another dataset or grid, refusing to resume")
+        return landscape
+
+    # Points that are not scored yet are NaN. The file is filled in blocks, so it can be larger than memory.
+    os.makedirs(path, exist_ok=True)
+    shape = tuple(len(v) for name, v in zip(LANDSCAPE_AXES, values) if name != 'c')  # (r, s, e1, e2, z)
+    max_errors = np.lib.format.open_memmap(os.path.join(path, 'max_errors.npy'), mode='w+', dtype=dtype, shape=shape)
+    flat = max_errors.reshape(-1)
+    for start in range(0, flat.size, BATCH_ELEMENTS):
+        flat[start:start + BATCH_ELEMENTS] = np.nan
+    max_errors.flush()
+    del flat, max_errors
+
+    meta = {'version': LANDSCAPE_VERSION, 'dataset': fingerprint, 'observations': len(times), 'axes': axes,
+            'stored_axes': ['r', 's', 'e1', 'e2', 'z'], 'dtype': np.dtype(dtype).name, 'tiles_written': 0,
+            'complete': False}
+    _writeAtomically(os.path.join(path, 'axes.json'), lambda file: file.write(json.dumps(meta).encode()))
+    return ErrorLandscape(path, 'r+')
+
+"""### Now lets fix r and s. Do a discretised exhaustive search over c, over e = (e1,e2), and over z to minimise the maximum angular error for the given r and s."""
+
+import numpy as np
+
+def bestOrbitInnerParams(r, s, times, oppositions, grid=None, resolution=None, workers=None,
+                         cache=inner_search_cache, early_abandon=None, telemetry=None, memory_budget=None,
+                         landscape=None):
+    telemetry = SearchTelemetry() if telemetry is None else telemetry  # Silent unless telemetry is given
+
+    # With a target resolution, search the fine grid by branch and bound instead of exhaustively
+    if resolution is not None:
+        if landscape is not None:
+            raise ValueError("Branch and bound does not score every grid point, a landscape needs a grid")
+        if cache is None:
+            result = branchAndBoundInnerParams(r, s, times, oppositions, resolution, telemetry=telemetry)
+        else:
+            key = cache.key(r, s, f'branch-and-bound:{resolution}', datasetFingerprint(times, oppositions))
+            result = cache.get(key)  # Reuse an earlier search of the same fine grid
+            if result is None:
+                result = branchAndBoundInnerParams(r, s, times, oppositions, resolution, telemetry=telemetry)
+                cache.put(key, result)
+        c, e1, e2, z, errors, max_error = result
+        return c, e1, e2, z, errors.copy(), max_error
+
+    # Score the whole (c, e1, e2, z) grid for this r and s in one batched call
+    with telemetry.level('bestOrbitInnerParams'):
+        _, _, c, e1, e2, z, errors, max_error = searchOrbitGrid([r], [s], times, oppositions, grid, workers, cache,
+                                                                early_abandon, telemetry, memory_budget,
+                                                                landscape=landscape)
+
+    return c, e1, e2, z, errors, max_error
+
+"""### Coarse-to-fine search with branch and bound
+
+An exhaustive sweep at a fine resolution is out of reach: at 0.1° the inner grid has about 10^13 points. Instead we split the fine grid into boxes of grid points, score one representative point per box and compute a lower bound on the max error anywhere in the box. Boxes whose bound cannot beat the best error found so far are dropped, and the rest are halved and scored again, until every remaining box is a single point.
+
+The bound comes from how fast the predicted longitude can move. With P = (e1 cos e2 + r cos θ, e1 sin e2 + r sin θ) the position of Mars and ρ = |P| ≥ r - e1 its distance from the Sun, the longitude changes by at most |dP| / ρ. So within a box, in degrees per unit of each parameter:
+
+- z: at most r / ρ
+- e2: at most e1 / ρ
+- e1: at most (180/π) / ρ
+- c: 0, since c only places the orbit centre which the residuals do not use
+
+Each residual moves at most as fast as the longitude, and so does their max. The max error at any point of the box is therefore at least the value at the representative point minus the sum of slope × distance over the parameters.
+
+The result is exactly the one an exhaustive sweep over `fineInnerGrid(resolution)` returns, including which point wins a tie.
+"""
 
-    return best_params
+E1_STEP_PER_DEGREE = 0.1 / 20  # e1 step that goes with a 1 degree angle step (0.1 for the default 20 degrees)
+BOUND_TOLERANCE = 1e-9  # Slack in degrees for rounding errors in the computed max errors
+
+def fineInnerGrid(resolution, e1_step=None):
+    e1_step = resolution * E1_STEP_PER_DEGREE if e1_step is None else e1_step  # Refine e1 with the angles
+    c_range = np.arange(0, 360, resolution)  # Search c from 0 to 360 in steps of resolution degrees
+    e1_range = np.arange(0, 0.2, e1_step)  # Search e1 from 0 to 0.2 in steps of e1_step
+    e2_range = np.arange(0, 360, resolution)  # Search e2 from 0 to 360 in steps of resolution degrees
+    z_range = np.arange(0, 360, resolution)  # Search z from 0 to 360 in steps of resolution degrees
+    return c_range, e1_range, e2_range, z_range
+
+def branchAndBoundInnerParams(r, s, times, oppositions, resolution=0.1, e1_step=None, coarse_step=20,
+                              return_stats=False, telemetry=None):
+    telemetry = SearchTelemetry() if telemetry is None else telemetry  # Silent unless telemetry is given
+    if not 0 < resolution < 360:
+        raise ValueError(f"resolution must be between 0 and 360 degrees, not {resolution}")
+    if e1_step is not None and not 0 < e1_step < 0.2:
+        raise ValueError(f"e1_step must be between 0 and 0.2, not {e1_step}")
+    grid = fineInnerGrid(resolution, e1_step)  # Fine grid that we want the best point of
+    c_range, e1_range, e2_range, z_range = grid  # Unpack the grid spec
+    sizes = np.array([len(g) for g in grid])  # Number of grid points along each axis
+
+    # Coarse starting boxes of about coarse_step degrees (and the matching e1 step).
+    # c is not split because the residuals do not depend on it.
+    steps = np.array([resolution, e1_range[1] - e1_range[0] if len(e1_range) > 1 else 1.0, resolution, resolution])
+    block = np.maximum(1, np.round(np.array([360, coarse_step * E1_STEP_PER_DEGREE, coarse_step, coarse_step]) / steps)).astype(int)
+    starts = [np.arange(0, n, b) for n, b in zip(sizes, block)]  # Start index of each block along each axis
+    lo = np.stack([g.ravel() for g in np.meshgrid(*starts, indexing='ij')], axis=1)  # Lower corner of each box
+    hi = np.minimum(lo + block, sizes)  # Upper corner of each box (exclusive)
+
+    # Representative points are grid points, so cos and sin of their e2 and z + s t can be looked up
+    tables = None
+    if RotationTables.fits(1, len(z_range), len(times)):
+        tables = RotationTables([s], times, oppositions, z_range, e2_range, telemetry)
 
-best_r, best_errors, best_max_error = bestR(0.518195, times, oppositions)
+    best_error = float('inf')  # Initialize best error to infinity
+    best_flat = np.iinfo(np.int64).max  # Flat grid index of the best point, used to break ties
+    best_params = None  # Initialize best parameters
+    evaluations = 0  # Number of parameter sets scored
+    levels = 0  # Number of refinement levels
+
+    while len(lo) > 0:
+        levels += 1
+        with telemetry.level(f'branch-and-bound level {levels}'):
+            # Slope bounds in each box, in degrees per unit of c, e1, e2 and z
+            e1_max = e1_range[hi[:, 1] - 1]  # Largest e1 in each box
+            with np.errstate(divide='ignore'):
+                rho = np.where(r > e1_max, r - e1_max, 0.0)  # Lower bound on the distance of Mars from the Sun
+                slopes = np.stack([np.zeros(len(lo)), np.degrees(1 / rho), e1_max / rho, r / rho], axis=1)
+
+            # Representative point: the middle of the box, or its first point along axes that do not move the residuals
+            rep = np.where(slopes > 0, (lo + hi - 1) // 2, lo)
+            values = [g[rep[:, k]] for k, g in enumerate(grid)]  # Parameter values at the representative points
+            if tables is None:
+                max_errors = maxErrorsBatch(values[0], r, values[1], values[2], values[3], s, times, oppositions)
+            else:
+                max_errors = tables.maxErrors(r, values[1], 0, rep[:, 2], rep[:, 3])
+            evaluations += len(lo)
+            telemetry.count(len(lo))
+
+            # The representative points are grid points, so they are candidates for the best
+            flat = np.ravel_multi_index(tuple(rep.T), sizes)  # Flat index of each representative point
+            j = np.lexsort((flat, max_errors))[0]  # Smallest max error, then smallest flat index
+            if max_errors[j] < best_error or (max_errors[j] == best_error and flat[j] < best_flat):
+                best_error, best_flat = max_errors[j], flat[j]
+                best_params = tuple(g[rep[j, k]] for k, g in enumerate(grid))
+                telemetry.best(best_error)
+
+            # Lower bound on the max error anywhere in each box
+            distance = np.stack([np.maximum(g[rep[:, k]] - g[lo[:, k]], g[hi[:, k] - 1] - g[rep[:, k]])
+                                 for k, g in enumerate(grid)], axis=1)  # Farthest grid point from rep along each axis
+            with np.errstate(invalid='ignore'):
+                bound = np.where(distance > 0, slopes * distance, 0.0).sum(axis=1)
+            lower = max_errors - bound - np.where(bound > 0, BOUND_TOLERANCE, 0.0)
+
+            # Keep boxes that could still hold a better point. A box with no bound left is fully known
+            # from its representative point. On a tie the box can only win if it starts before the best.
+            corner = np.ravel_multi_index(tuple(lo.T), sizes)  # Smallest flat index in each box
+            keep = (bound > 0) & ((lower < best_error) | ((lower == best_error) & (corner < best_flat)))
+            lo, hi, slopes = lo[keep], hi[keep], slopes[keep]
+
+            # Halve the kept boxes along every axis that is longer than one point and moves the residuals
+            for k in range(4):
+                split = (hi[:, k] - lo[:, k] > 1) & (slopes[:, k] > 0)
+                mid = (lo[split, k] + hi[split, k]) // 2
+                upper_lo, upper_hi = lo[split].copy(), hi[split].copy()  # Upper halves of the split boxes
+                upper_lo[:, k] = mid
+                hi[split, k] = mid  # Lower halves stay in place
+                lo = np.concatenate([lo, upper_lo])
+                hi = np.concatenate([hi, upper_hi])
+                slopes = np.concatenate([slopes, slopes[split]])
+
+    # Recompute the errors at the best point
+    c, e1, e2, z = best_params
+    errors, max_error = MarsEquantModelBatch(c, r, e1, e2, z, s, times, oppositions)
+    max_error = max_error[()]  # Plain scalar instead of a 0-d array
+
+    if return_stats:
+        stats = {'evaluations': evaluations, 'exhaustive_evaluations': int(np.prod(sizes)), 'levels': levels}
+        return c, e1, e2, z, errors, max_error, stats
+    return c, e1, e2, z, errors, max_error
 
-# Now use the best r to find the other optimal parameters
-best_c, best_e1, best_e2, best_z, _, _ = bestOrbitInnerParams(best_r, 0.518195, times, oppositions)
+"""### Fix r. Do a discretised search for s"""
 
-# Print the best values
-print(f"\nBest parameters:")
-print(f"r = {best_r:.6f}")
-print(f"s = 0.518195")  # Fixed value
-print(f"c = {best_c:.6f}")
-print(f"e1 = {best_e1:.6f}")
-print(f"e2 = {best_e2:.6f}")
-print(f"z = {best_z:.6f}")
-print(f"Maximum error = {best_max_error:.6f}")
+def bestS(r, times, oppositions, grid=None, workers=None, cache=inner_search_cache, early_abandon=None,
+          telemetry=None, memory_budget=None):
+    telemetry = SearchTelemetry() if telemetry is None else telemetry  # Silent unless telemetry is given
+
+    # Define search range for s
+    s_range = np.linspace(360/687 * 0.9, 360/687 * 1.1, 10)  # Search around 360/687, ±10%, with 10 points
+
+    # Search all the s values and the inner grid together
+    with telemetry.level('bestS'):
+        return searchOrbitGrid([r], s_range, times, oppositions, grid, workers, cache, early_abandon, telemetry,
+                               memory_budget)
+
+"""### Fix s Do discrete search for r"""
+
+def bestR(s, times, oppositions, grid=None, workers=None, cache=inner_search_cache, early_abandon=None,
+          telemetry=None, memory_budget=None):
+    telemetry = SearchTelemetry() if telemetry is None else telemetry  # Silent unless telemetry is given
+
+    s_fixed = 0.518195  # Fixed value for s
+    r_range = np.linspace(1.52 * 0.9, 1.52 * 1.1, 10)  # Search around 1.52, ±10%, with 20 points
+
+    # Search all the r values and the inner grid
+    with telemetry.level('bestR'):
+        return searchOrbitGrid(r_range, [s_fixed], times, oppositions, grid, workers, cache, early_abandon, telemetry,
+                               memory_budget)
 
 """### Search iteratively over r and s"""
 
-def bestMarsOrbitParams(times, oppositions):
+def marsOrbitSearchRanges():
     r_initial = 1.520000
     s_initial = 0.518195
 
     r_range = np.linspace(r_initial * 0.95, r_initial * 1.05, 6)
     s_range = np.linspace(s_initial * 0.95, s_initial * 1.05, 6)
 
-    best_error = float('inf')
-    best_params = None
+    return r_range, s_range
 
-    for r in r_range:
-        for s in s_range:
-            c, e1, e2, z, errors, max_error = bestOrbitInnerParams(r, s, times, oppositions)
+def bestMarsOrbitParams(times, oppositions, grid=None, workers=None, cache=inner_search_cache, early_abandon=None,
+                        telemetry=None, memory_budget=None, checkpoint=None, resume=False, landscape=None):
+    telemetry = SearchTelemetry() if telemetry is None else telemetry  # Silent unless telemetry is given
+    r_range, s_range = marsOrbitSearchRanges()  # r and s values to search
 
-            if max_error < best_error:
-                best_error = max_error
-                best_params = (r, s, c, e1, e2, z, errors, max_error)
+    # Search the 6x6 (r, s) grid and the inner grid
+    with telemetry.level('bestMarsOrbitParams'):
+        return searchOrbitGrid(r_range, s_range, times, oppositions, grid, workers, cache, early_abandon, telemetry,
+                               memory_budget, checkpoint, resume, landscape)
 
-    return best_params
+"""### Refine the grid optimum continuously
 
-# Use the function
-r, s, c, e1, e2, z, errors, maxError = bestMarsOrbitParams(times, oppositions)
+The grid searches can only be as good as their step: 20° in c, e2 and z, and e1 is either 0 or 0.1. `refineMarsOrbitParams` takes the best few grid points and moves all the parameters continuously to bring the max error down further.
 
-print(f"\nBest parameters:")
-print(f"r = {r:.6f}")
-print(f"s = {s:.6f}")
-print(f"c = {c:.6f}")
-print(f"e1 = {e1:.6f}")
-print(f"e2 = {e2:.6f}")
-print(f"z = {z:.6f}")
-print(f"Maximum error = {maxError:.6f}")
+The max error is not smooth, so we minimise a smoothed max instead,
 
-# Print the complete errors array
-print("\nErrors array:")
-print(errors)
+F(p) = (1/β) log Σ_i (exp(β e_i(p)) + exp(-β e_i(p))),
 
-# Print the opposition array
-print("\nOpposition array:")
-print(oppositions)
+which is never more than log(2n)/β above the max error. `MarsEquantModelGradient` gives the errors e_i together with their exact derivatives. Each step is a damped Newton step on F. After every round β is multiplied by 10, until log(2n)/β is below the tolerance and a round no longer improves the max error by more than the tolerance.
 
-# Calculate predicted oppositions by subtracting errors from actual oppositions
-predicted_oppositions = oppositions - errors
+c is kept as it is: the predicted longitudes do not depend on it. If e1 ends up negative, the equant is moved to the equivalent position (-e1, e2 + 180).
+"""
 
-# Print the predicted opposition array
-print("\nPredicted Opposition array:")
-print(predicted_oppositions)
+def MarsEquantModelGradient(c, r, e1, e2, z, s, times, oppositions):
+    times = np.asarray(times, dtype=float)  # Observation times as a float array
+    errors, max_error = MarsEquantModelBatch(c, r, e1, e2, z, s, times, oppositions)  # Errors at this point
 
-# Calculate the difference between actual and predicted oppositions
-opposition_difference = oppositions - predicted_oppositions
+    # Position of Mars relative to the Sun for every observation
+    e2_rad = np.radians(e2)  # Convert e2 to radians
+    angle = np.radians(z) + np.radians(s * times)  # Angle of Mars around the equant
+    mars_x = e1 * np.cos(e2_rad) + r * np.cos(angle)  # X-coordinate of Mars relative to Sun
+    mars_y = e1 * np.sin(e2_rad) + r * np.sin(angle)  # Y-coordinate of Mars relative to Sun
+    distance2 = mars_x ** 2 + mars_y ** 2  # Squared distance of Mars from the Sun
+
+    # The predicted longitude moves by (x dy - y dx) / (x^2 + y^2) radians when Mars moves by (dx, dy)
+    along_orbit = r * (mars_x * np.cos(angle) + mars_y * np.sin(angle)) / distance2  # Per radian of angle
+    gradient = np.stack([
+        np.zeros_like(times),  # c does not move the predicted longitude
+        np.degrees((mars_x * np.sin(angle) - mars_y * np.cos(angle)) / distance2),  # Degrees per unit of r
+        np.degrees((mars_x * np.sin(e2_rad) - mars_y * np.cos(e2_rad)) / distance2),  # Degrees per unit of e1
+        e1 * (mars_x * np.cos(e2_rad) + mars_y * np.sin(e2_rad)) / distance2,  # Degrees per degree of e2
+        along_orbit,  # Degrees per degree of z
+        along_orbit * times,  # Degrees per degree/day of s
+    ], axis=1)
+
+    return errors, max_error[()], gradient  # Errors, max error and d(errors)/d(c, r, e1, e2, z, s)
+
+def gridCandidates(r_values, s_values, times, oppositions, k=5, grid=None):
+    grid = DEFAULT_INNER_GRID if grid is None else grid  # Use the default inner grid if none is given
+    c_range, e1_range, e2_range, z_range = grid  # Unpack the grid spec
+    s_values = np.atleast_1d(s_values)  # Make sure s is an array
+
+    # c does not change the errors, so only its first value is used. Otherwise the
+    # best k points would just be copies of one point with different c.
+    c, e1, e2, z = innerGrid((c_range[:1], e1_range, e2_range, z_range))
+    s_col = s_values.reshape(-1, 1, 1, 1, 1)  # s on the leading axis, in front of (c, e1, e2, z)
+
+    # The cos and sin tables of the s values are shared by all r values
+    tables = None
+    if RotationTables.fits(len(s_values), len(z_range), len(times)):
+        tables = RotationTables(s_values, times, oppositions, z_range, e2_range)
+        i_s = np.arange(len(s_values)).reshape(-1, 1, 1, 1)
+        i_e2, i_z = np.ix_(range(len(e2_range)), range(len(z_range)))
+
+    top_errors = np.empty(0)  # Max errors of the best points so far
+    top_index = np.empty((0, 6), dtype=int)  # (r, s, c, e1, e2, z) grid positions of the best points so far
+    for i_r, r in enumerate(np.atleast_1d(r_values)):
+        if tables is None:
+            max_errors = maxErrorsBatch(c, r, e1, e2, z, s_col, times, oppositions)
+        else:
+            max_errors = tables.maxErrors(r, e1_range.reshape(-1, 1, 1), i_s, i_e2, i_z)[:, np.newaxis]
+        flat = max_errors.ravel()  # Max errors in (s, c, e1, e2, z) order
+        best = np.argsort(flat, kind='stable')[:k]  # Best k points of this r, ties in grid order
+        index = np.column_stack([np.full(len(best), i_r), *np.unravel_index(best, max_errors.shape)])
+
+        # Merge with the best points so far, keeping grid order on ties
+        top_errors = np.concatenate([top_errors, flat[best]])
+        top_index = np.concatenate([top_index, index])
+        order = np.lexsort((*top_index.T[::-1], top_errors))[:k]
+        top_errors, top_index = top_errors[order], top_index[order]
+
+    candidates = []
+    for i_r, i_s, i_c, i_e1, i_e2, i_z in top_index:
+        r, s = np.atleast_1d(r_values)[i_r], s_values[i_s]
+        c, e1, e2, z = c_range[i_c], e1_range[i_e1], e2_range[i_e2], z_range[i_z]
+        errors, max_error = MarsEquantModelBatch(c, r, e1, e2, z, s, times, oppositions)
+        candidates.append((r, s, c, e1, e2, z, errors, max_error[()]))
+    return candidates  # Best k (r, s, c, e1, e2, z, errors, max_error), best first
+
+def _smoothedMax(errors, beta):
+    values = np.concatenate([errors, -errors])  # Both signs of every error
+    top = np.max(values)  # Largest value, taken out for numerical stability
+    weights = np.exp(beta * (values - top))  # Unnormalised softmax weights
+    total = weights.sum()
+    weights /= total
+    n = len(errors)
+    # Smoothed max, its derivative per error and the total weight of every error
+    return top + np.log(total) / beta, weights[:n] - weights[n:], weights[:n] + weights[n:]
+
+def refineOrbitParams(params, times, oppositions, tol=1e-6, max_iterations=500, telemetry=None):
+    telemetry = SearchTelemetry() if telemetry is None else telemetry  # Silent unless telemetry is given
+    r, s, c, e1, e2, z = (float(p) for p in params[:6])  # Starting point, usually a grid point
+    x = np.array([r, e1, e2, z, s])  # Parameters that move the predicted longitudes
+    evaluations = 0  # Number of model evaluations
+
+    def evaluate(x, beta):
+        r, e1, e2, z, s = x
+        errors, max_error, gradient = MarsEquantModelGradient(c, r, e1, e2, z, s, times, oppositions)
+        value, weights, mass = _smoothedMax(errors, beta)
+        jac = gradient[:, 1:]  # Drop the c column
+        g = jac.T @ weights  # Gradient of the smoothed max
+        h = beta * ((jac.T * mass) @ jac - np.outer(g, g))  # Its Hessian, without second derivatives of the errors
+        return value, g, h, max_error
+
+    beta = 1.0  # Start smooth enough to move between the grid points
+    final_beta = np.log(2 * len(times)) / tol  # Smoothing at which the smoothed max is within tol of the max
+    best_x, best_error = x.copy(), float(params[7])  # Best point by the actual max error
+    iterations = 0
+
+    while iterations < max_iterations:
+        damping = 1e-3  # Levenberg-Marquardt damping
+        value, g, h, max_error = evaluate(x, beta)
+        evaluations += 1
+        telemetry.count(1)
+        round_start_error = best_error
+
+        # Damped Newton steps on the smoothed max for this beta
+        while iterations < max_iterations:
+            iterations += 1
+            step = -np.linalg.solve(h + damping * np.diag(np.diag(h) + 1e-12), g)
+            new_value, new_g, new_h, new_max = evaluate(x + step, beta)
+            evaluations += 1
+            telemetry.count(1)
+            if new_value < value:
+                x, value, g, h = x + step, new_value, new_g, new_h
+                damping = max(damping / 3, 1e-12)
+                if new_max < best_error:
+                    best_x, best_error = x.copy(), new_max
+                    telemetry.best(best_error)
+                if value - new_value < tol * 1e-3 and np.all(np.abs(step) < tol):
+                    break
+            else:
+                damping *= 4
+                if damping > 1e12:
+                    break
+
+        # Stop once the smoothing is fine enough and a round no longer helps
+        if beta >= final_beta and round_start_error - best_error < tol:
+            break
+        beta = min(beta * 10, final_beta)
+
+    # Move the equant to the usual polar form and the angles to 0-360
+    r, e1, e2, z, s = best_x
+    if e1 < 0:
+        e1, e2 = -e1, e2 + 180
+    e2, z = e2 % 360, z % 360
+    errors, max_error = MarsEquantModelBatch(c, r, e1, e2, z, s, times, oppositions)
+    return (r, s, c, e1, e2, z, errors, max_error[()]), evaluations
+
+def refineMarsOrbitParams(times, oppositions, candidates=None, k=5, tol=1e-6, grid=None, telemetry=None):
+    telemetry = SearchTelemetry() if telemetry is None else telemetry  # Silent unless telemetry is given
+
+    # Start from the best k points of the bestMarsOrbitParams grid unless candidates are given
+    if candidates is None:
+        r_range, s_range = marsOrbitSearchRanges()
+        candidates = gridCandidates(r_range, s_range, times, oppositions, k, grid)
 
-# Print the difference
-print("\nDifference between actual and predicted oppositions:")
-print(opposition_difference)
+    best_params = None  # Initialize best parameters
+    evaluations = 0  # Number of model evaluations over all candidates
+    for candidate in candidates:
+        with telemetry.level('refine'):
+            params, count = refineOrbitParams(candidate, times, oppositions, tol, telemetry=telemetry)
+        evaluations += count
+        if best_params is None or params[7] < best_params[7]:
+            best_params = params
 
-import matplotlib.pyplot as plt
+    stats = {'candidates': len(candidates), 'evaluations': evaluations}
+    return best_params, stats
 
-# Create a scatter plot
-plt.figure(figsize=(12, 8))
+"""### Uncertainty of the parameters
 
-# Plot actual oppositions
-plt.scatter(range(len(oppositions)), oppositions, color='blue', label='Actual Oppositions')
+To put error bars on the parameters we fit many resampled datasets: bootstrap resamples, which draw n observations with replacement, or leave-one-out datasets, which drop one opposition each. A max error only depends on which observations are in a dataset, not on how often, so every dataset is a mask over the observations. The max error of a parameter set on a dataset is then the largest of its absolute errors where the mask is set.
 
-# Plot predicted oppositions
-plt.scatter(range(len(predicted_oppositions)), predicted_oppositions, color='red', label='Predicted Oppositions')
+`batchedGridFits` fits all the datasets in one pass over the `bestMarsOrbitParams` grid. For every (r, s) pair the errors of every (e1, e2, z) point are computed once, from rotation tables shared by all pairs, and the masks are applied to them as an extra batch axis. The points are scored in blocks and the observations in chunks, keeping a running max error of every dataset like `RotationTables.maxErrors`, so the memory stays within `BATCH_ELEMENTS` elements per array. When the tables do not fit, or the compute backend has no tables, each dataset is scored on its own observations with `maxErrorsBatch` instead. Each dataset keeps its own best point, with ties going to the first point in grid order, so every fit is exactly the fit `bestMarsOrbitParams` would find on that dataset alone. With `refine=True` every fit is then refined continuously on its own dataset.
 
-# Customize the plot
-plt.xlabel('Observation Index')
-plt.ylabel('Opposition (degrees)')
-plt.title('Actual vs Predicted Mars Oppositions')
-plt.legend()
+`fitUncertainty` makes the datasets, fits them, optionally on `workers` processes that each take a share of the datasets, and summarises every parameter: the fit on the full data, the mean and standard deviation of the resampled fits and a confidence interval. For bootstrap the interval is the percentile interval. For leave-one-out it is the jackknife interval, the full fit ± z × the jackknife standard error. The angles (c, e2 and z) are first unwrapped to within 180° of the full fit. c does not enter the errors, so every fit keeps the first c of the grid and its interval says nothing about the data.
+"""
 
-# Add a grid for better readability
-plt.grid(True, linestyle='--', alpha=0.7)
+PARAMETER_NAMES = ('r', 's', 'c', 'e1', 'e2', 'z')  # Order of the parameters in the fits
+ANGLE_PARAMETERS = ('c', 'e2', 'z')  # Parameters in degrees that wrap around at 360
+
+def bootstrapDatasets(n_observations, n_resamples=200, seed=0):
+    rng = np.random.default_rng(seed)  # Seeded so that the same resamples come back
+    draws = rng.integers(0, n_observations, size=(n_resamples, n_observations))  # Observations drawn for each resample
+    masks = np.zeros((n_resamples, n_observations), dtype=bool)
+    masks[np.arange(n_resamples)[:, np.newaxis], draws] = True  # Observations in each resample
+    return masks
+
+def leaveOneOutDatasets(n_observations):
+    return ~np.eye(n_observations, dtype=bool)  # Dataset i leaves out observation i
+
+def batchedGridFits(masks, times, oppositions, r_values=None, s_values=None, grid=None, telemetry=None):
+    grid = DEFAULT_INNER_GRID if grid is None else grid  # Use the default inner grid if none is given
+    telemetry = SearchTelemetry() if telemetry is None else telemetry  # Silent unless telemetry is given
+    c_range, e1_range, e2_range, z_range = grid  # Unpack the grid spec
+    if r_values is None or s_values is None:
+        r_values, s_values = marsOrbitSearchRanges()  # The grid of bestMarsOrbitParams
+    s_values = np.atleast_1d(s_values)
+    masks = np.asarray(masks, dtype=bool)
+    shape = (len(e1_range), len(e2_range), len(z_range))  # Inner grid without c
+    points = int(np.prod(shape))
+    block = max(1, min(points, BATCH_ELEMENTS // len(masks)))  # Inner points scored at once
+    chunk = max(1, BATCH_ELEMENTS // (len(masks) * block))  # Observations scored at once
+
+    # The cos and sin tables of the s values are shared by all r values, when they fit
+    tables = None
+    if compute_backend.tables and RotationTables.fits(len(s_values), len(z_range), len(times)):
+        tables = RotationTables(s_values, times, oppositions, z_range, e2_range, telemetry)
+
+    best_errors = np.full(len(masks), np.inf)  # Best max error of each dataset
+    best_index = np.zeros((len(masks), 3), dtype=np.int64)  # (r, s, flat inner) position of each best point
+    for i_r, r in enumerate(np.atleast_1d(r_values)):
+        for i_s, s in enumerate(s_values):
+            # Max error of a block of inner points on every dataset, the datasets on the first axis
+            for start in range(0, points, block):
+                flat = np.arange(start, min(start + block, points))  # Flat positions in the inner grid
+                i_e1, i_e2, i_z = np.unravel_index(flat, shape)
+                if tables is None:
+                    # Score each dataset on its own observations with the compute backend
+                    max_errors = np.array([maxErrorsBatch(0, r, e1_range[i_e1], e2_range[i_e2], z_range[i_z], s,
+                                                          times[mask], oppositions[mask]) for mask in masks])
+                else:
+                    # Keep the largest error of each dataset, chunk by chunk like RotationTables.maxErrors.
+                    # The errors of a chunk are shared by all datasets, and masked errors count as 0.
+                    max_errors = np.zeros((len(masks), len(flat)))
+                    for first in range(0, len(times), chunk):
+                        observations = slice(first, first + chunk)
+                        errors = tables.errors(r, e1_range[i_e1], i_s, i_e2, i_z, observations,
+                                               count_points=first == 0)
+                        np.maximum(max_errors, np.max(np.abs(errors) * masks[:, np.newaxis, observations], axis=-1),
+                                   out=max_errors)
+                j = np.argmin(max_errors, axis=1)  # First smallest max error of each dataset
+                found = max_errors[np.arange(len(j)), j]
+                better = found < best_errors  # Earlier points win ties
+                best_errors[better] = found[better]
+                best_index[better] = np.column_stack([np.full(len(j), i_r), np.full(len(j), i_s), start + j])[better]
+            telemetry.count(points * len(c_range) * len(masks))
+
+    # Parameters of each fit
+    i_e1, i_e2, i_z = np.unravel_index(best_index[:, 2], shape)
+    fits = np.column_stack([np.atleast_1d(r_values)[best_index[:, 0]], s_values[best_index[:, 1]],
+                            np.full(len(masks), c_range[0]), e1_range[i_e1], e2_range[i_e2], z_range[i_z]])
+    return fits, best_errors  # (r, s, c, e1, e2, z) and max error of each dataset
+
+def _refineFits(fits, masks, times, oppositions):
+    refined, max_errors = np.empty_like(fits), np.empty(len(fits))
+    for k, ((r, s, c, e1, e2, z), mask) in enumerate(zip(fits, masks)):
+        t, o = times[mask], oppositions[mask]  # This dataset
+        errors, max_error = MarsEquantModelBatch(c, r, e1, e2, z, s, t, o)
+        params, _ = refineOrbitParams((r, s, c, e1, e2, z, errors, max_error[()]), t, o)
+        refined[k], max_errors[k] = params[:6], params[7]
+    return refined, max_errors
+
+def _uncertaintyTask(task):
+    masks, r_values, s_values, grid, refine = task  # Unpack the task
+    times, oppositions = _worker_data  # Observations sent when the worker started
+    fits, max_errors = batchedGridFits(masks, times, oppositions, r_values, s_values, grid)
+    return _refineFits(fits, masks, times, oppositions) if refine else (fits, max_errors)
+
+def summarizeFits(fits, estimate, method='bootstrap', confidence=0.95):
+    from statistics import NormalDist
+
+    summary = {}
+    for k, name in enumerate(PARAMETER_NAMES):
+        values = fits[:, k]
+        if name in ANGLE_PARAMETERS:
+            values = estimate[k] + (values - estimate[k] + 180) % 360 - 180  # Unwrap to within 180° of the estimate
+        if method == 'loo':
+            # Jackknife standard error and interval around the full fit
+            n = len(values)
+            error = np.sqrt((n - 1) / n * np.sum((values - values.mean()) ** 2))
+            quantile = NormalDist().inv_cdf(0.5 + confidence / 2)
+            interval = (estimate[k] - quantile * error, estimate[k] + quantile * error)
+        else:
+            interval = tuple(np.percentile(values, [50 - 50 * confidence, 50 + 50 * confidence]))
+        summary[name] = {'estimate': float(estimate[k]), 'mean': float(values.mean()), 'std': float(values.std()),
+                         'interval': tuple(float(v) for v in interval), 'values': values}
+    return summary
+
+def fitUncertainty(times, oppositions, method='bootstrap', n_resamples=200, seed=0, confidence=0.95, refine=False,
+                   workers=None, grid=None, r_values=None, s_values=None, telemetry=None):
+    telemetry = SearchTelemetry() if telemetry is None else telemetry  # Silent unless telemetry is given
+    times, oppositions = np.asarray(times, dtype=float), np.asarray(oppositions, dtype=float)
+    if method == 'bootstrap':
+        masks = bootstrapDatasets(len(times), n_resamples, seed)
+    elif method == 'loo':
+        masks = leaveOneOutDatasets(len(times))
+    else:
+        raise ValueError(f"Unknown method {method!r}, use 'bootstrap' or 'loo'")
+    masks = np.concatenate([np.ones((1, len(times)), dtype=bool), masks])  # The full data goes first
+
+    start = time.perf_counter()
+    with telemetry.level(f'fitUncertainty ({method})'):
+        if workers is not None and workers > 1:
+            from concurrent.futures import ProcessPoolExecutor  # Imported here because it is slow to import
+
+            # Every worker fits a share of the datasets
+            shares = np.array_split(masks, min(workers, len(masks)))
+            tasks = [(share, r_values, s_values, grid, refine) for share in shares]
+            with ProcessPoolExecutor(max_workers=workers, initializer=_initSearchWorker,
+                                     initargs=(compute_backend.name,) + _workerData(times, oppositions)) as pool:
+                parts = list(pool.map(_uncertaintyTask, tasks))
+            fits = np.concatenate([fits for fits, _ in parts])
+            max_errors = np.concatenate([max_errors for _, max_errors in parts])
+        else:
+            fits, max_errors = batchedGridFits(masks, times, oppositions, r_values, s_values, grid, telemetry)
+            if refine:
+                fits, max_errors = _refineFits(fits, masks, times, oppositions)
+    seconds = time.perf_counter() - start
+
+    return {'method': method, 'confidence': confidence, 'fit': tuple(fits[0]), 'max_error': max_errors[0],
+            'fits': fits[1:], 'max_errors': max_errors[1:], 'masks': masks[1:],
+            'parameters': summarizeFits(fits[1:], fits[0], method, confidence),
+            'seconds': seconds, 'fits_per_second': len(masks) / seconds if seconds > 0 else float('inf')}
+
+"""### Adding oppositions one at a time
+
+When a new opposition is observed, `bestMarsOrbitParams` would search the whole grid again on all the observations. But an extra observation can only raise the max error of a parameter set: its new max error is the larger of the old max error and its error on the new observation. `IncrementalOrbitFit` uses that to update a fit with little work:
+
+- It keeps the best k points of the grid (the candidates) with all their errors. The other points are grouped in blocks, one for every (r, s, e1, e2) along z, and every block has a lower bound on the max error of its points that are not candidates.
+- `addOpposition` computes the error of the new observation for the candidates only, which updates their max errors exactly, and the best candidate becomes the new best guess.
+- A block whose bound is below the best guess could hide a better point, so its points are scored again on all the observations and compete with the candidates. The other blocks keep their bounds, which are still lower bounds. Usually few blocks are searched, and often none: the update then costs k model evaluations.
+
+Points that do not make it into the k candidates lower the bound of their block to their max error. The best point is therefore always the one a new `bestMarsOrbitParams` search would find, including on ties, and its errors come from the candidates' cached errors.
+"""
 
-# Show the plot
-plt.show()
+class IncrementalOrbitFit:
+    def __init__(self, times, oppositions, k=16, grid=None, r_values=None, s_values=None):
+        self.grid = DEFAULT_INNER_GRID if grid is None else grid  # Use the default inner grid if none is given
+        if r_values is None or s_values is None:
+            r_values, s_values = marsOrbitSearchRanges()  # The grid of bestMarsOrbitParams
+        self.pairs = np.array([(r, s) for r in np.atleast_1d(r_values) for s in np.atleast_1d(s_values)], dtype=float)
+        self.k = k  # Number of candidates kept
+        self.times = np.array(times, dtype=float)  # Observations so far
+        self.oppositions = np.array(oppositions, dtype=float)
+        self.shape = (len(self.pairs),) + tuple(len(g) for g in self.grid[1:])  # (pair, e1, e2, z), c is not searched
+        self.block_size = self.shape[-1]  # Points of a block: the z values
+
+        self.candidates = np.empty(0, dtype=np.int64)  # Flat (pair, e1, e2, z) index of each candidate
+        self.candidate_max = np.empty(0)  # Max error of each candidate
+        self.candidate_errors = np.empty((0, len(self.times)))  # Errors of each candidate on every observation
+        self.block_bounds = np.full(int(np.prod(self.shape[:-1])), np.inf)  # Bound on the other points of each block
+
+        # Cold fit: search every block
+        self.updates = 0
+        self._searchBlocks(np.arange(len(self.block_bounds)))
+        self.blocks_searched = len(self.block_bounds)  # Blocks searched by the last update
+        self.candidate_evaluations = 0  # Errors computed for candidates by the last update
+
+    def _params(self, flat):
+        # (c, r, e1, e2, z, s) arrays of flat grid indices, in the order of MarsEquantModelBatch
+        pair, i_e1, i_e2, i_z = np.unravel_index(flat, self.shape)
+        c_range, e1_range, e2_range, z_range = self.grid
+        r, s = self.pairs[pair, 0], self.pairs[pair, 1]
+        return np.full(np.shape(flat), c_range[0]), r, e1_range[i_e1], e2_range[i_e2], z_range[i_z], s
+
+    def _searchBlocks(self, blocks):
+        # Score every point of the blocks on all the observations
+        flat = blocks[:, np.newaxis] * self.block_size + np.arange(self.block_size)  # Axes (block, z)
+        max_errors = maxErrorsBatch(*self._params(flat), self.times, self.oppositions).ravel()
+        flat = flat.ravel()
+
+        # Their points replace their candidates, and only the best k points overall stay candidates
+        keep = ~np.isin(self.candidates // self.block_size, blocks)
+        self.candidates, self.candidate_max = self.candidates[keep], self.candidate_max[keep]
+        self.candidate_errors = self.candidate_errors[keep]
+        self.block_bounds[blocks] = np.inf
+        points = np.concatenate([self.candidates, flat])
+        points_max = np.concatenate([self.candidate_max, max_errors])
+        order = np.lexsort((points, points_max))  # Smallest max error first, grid order on ties
+
+        # A point that is dropped bounds the other points of its block
+        dropped = order[self.k:]
+        np.minimum.at(self.block_bounds, points[dropped] // self.block_size, points_max[dropped])
+
+        kept = np.sort(order[:self.k])  # Old candidates first, then the new ones
+        old, new = kept[kept < len(self.candidates)], kept[kept >= len(self.candidates)]
+        errors, _ = MarsEquantModelBatch(*self._params(points[new]), self.times, self.oppositions)
+        self.candidate_errors = np.concatenate([self.candidate_errors[old], errors])  # Only new ones are scored
+        self.candidates, self.candidate_max = points[kept], points_max[kept]
+
+    def best(self):
+        j = np.lexsort((self.candidates, self.candidate_max))[0]  # Smallest max error, then grid order
+        c, r, e1, e2, z, s = (p[j] for p in self._params(self.candidates))
+        return r, s, c, e1, e2, z, self.candidate_errors[j].copy(), self.candidate_max[j]
+
+    def addOpposition(self, time, opposition):
+        self.times = np.append(self.times, float(time))
+        self.oppositions = np.append(self.oppositions, float(opposition))
+        self.updates += 1
+
+        # Error of the new observation for every candidate
+        errors, _ = MarsEquantModelBatch(*self._params(self.candidates), self.times[-1:], self.oppositions[-1:])
+        self.candidate_errors = np.concatenate([self.candidate_errors, errors], axis=1)
+        self.candidate_max = np.maximum(self.candidate_max, np.abs(errors[:, 0]))
+        self.candidate_evaluations = len(self.candidates)
+
+        # Search the blocks that could hold a point at least as good as the best candidate. The
+        # blocks that are left out have bounds above the best candidate, so also above the new best.
+        j = np.lexsort((self.candidates, self.candidate_max))[0]
+        best_max, best_flat = self.candidate_max[j], self.candidates[j]
+        first = np.arange(len(self.block_bounds)) * self.block_size  # First point of each block
+        blocks = np.flatnonzero((self.block_bounds < best_max) |
+                                ((self.block_bounds == best_max) & (first < best_flat)))
+        if len(blocks):
+            self._searchBlocks(blocks)
+        self.blocks_searched = len(blocks)
+        return self.best()
+
+    def stats(self):
+        return {'observations': len(self.times), 'updates': self.updates, 'candidates': len(self.candidates),
+                'blocks': len(self.block_bounds), 'blocks_searched': self.blocks_searched,
+                'candidate_evaluations': self.candidate_evaluations}
+
+"""### Scaling with the number of observations
+
+`benchmarkObservationScaling` runs the inner search on synthetic datasets of increasing size and measures the time and the peak memory allocated (with tracemalloc) for each size. The time grows linearly with the number of observations, while the memory stays near `BATCH_ELEMENTS` errors once the observations no longer fit in one chunk.
+"""
+
+def benchmarkObservationScaling(counts=(12, 120, 1200, 12000, 120000), r=1.5, s=0.524, grid=None):
+    import tracemalloc
+
+    results = []
+    for n in counts:
+        times, oppositions = syntheticOppositions(n)
+        tracemalloc.start()
+        start = time.perf_counter()
+        bestOrbitInnerParams(r, s, times, oppositions, grid, cache=None)
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]  # Largest memory allocated at once during the search
+        tracemalloc.stop()
+        results.append({'observations': n, 'seconds': seconds, 'peak_bytes': peak,
+                        'errors_per_second': np.prod([len(g) for g in (grid or DEFAULT_INNER_GRID)]) * n / seconds})
+    return results
+
+"""### Benchmarks
+
+`runBenchmarks` measures the model and the searches on `benchmarkDataset`, a synthetic dataset generated from known parameters (`BENCHMARK_PARAMS`). The parameters are a point of the `bestMarsOrbitParams` grid, so that search should find them, with a max error at the level of the noise. It measures:
+
+- `model_seconds`: the time of one `MarsEquantModel` call,
+- `inner_evaluations_per_second`: parameter sets scored per second by `bestOrbitInnerParams`,
+- `bestS_seconds`, `bestR_seconds` and `bestMarsOrbitParams_seconds`: the end-to-end time of each search, without the cache of inner searches,
+- `peak_bytes`: the largest memory allocated at once during `bestMarsOrbitParams`, measured with tracemalloc in a separate run because tracemalloc slows the search down,
+- `import_seconds`: the import time of this module on top of numpy.
+
+Every timing is the best of `repeats` runs. A search of the small default dataset takes a few milliseconds, too short to time reliably, so each run calls the function as many times as it takes to last at least `BENCHMARK_MIN_SECONDS`, and the time per call is kept. The result also records the dataset, the backend, the numpy and Python versions, and the git commit. The max error of the true parameters and of the `bestMarsOrbitParams` fit are recorded too.
+
+`saveBenchmark` appends a result to a JSON history file (`BENCHMARK_HISTORY`). `compareBenchmarks` compares the metrics of two results and marks the ones that got worse by more than `tolerance` as regressions. The default, `BENCHMARK_TOLERANCE`, is 25%: even the best of several runs of 0.2 seconds can move by 10 to 20% between two runs on a busy or shared machine. The `bench` command runs the benchmarks, saves them, and compares them with the last result in the history that has the same dataset and backend.
+"""
+
+BENCHMARK_PARAMS = {'c': 140.0, 'r': 1.5048, 'e1': 0.1, 'e2': 100.0, 'z': 60.0, 's': 0.52337695}  # A grid point
+BENCHMARK_HISTORY = 'benchmarks.json'  # History file of saveBenchmark
+BENCHMARK_MIN_SECONDS = 0.2  # Shortest run of a timing, calling the function as often as needed
+BENCHMARK_TOLERANCE = 0.25  # Relative change compareBenchmarks reports as a regression, above the timing noise
+BENCHMARK_METRICS = {'model_seconds': False, 'inner_evaluations_per_second': True, 'bestS_seconds': False,
+                     'bestR_seconds': False, 'bestMarsOrbitParams_seconds': False, 'peak_bytes': False,
+                     'import_seconds': False}  # Whether higher is better for each metric
+
+def benchmarkDataset(n=12, seed=0, noise=0.05):
+    p = BENCHMARK_PARAMS
+    return syntheticOppositions(n, p['r'], p['s'], p['e1'], p['e2'], p['z'], noise, seed)
+
+def _bestTime(function, repeats, min_seconds=BENCHMARK_MIN_SECONDS):
+    # Calls per run, so that a run takes at least min_seconds. Short timings are too noisy to compare.
+    start = time.perf_counter()
+    result = function()  # Also warms up the caches of numpy and of the tables
+    calls = max(1, math.ceil(min_seconds / max(time.perf_counter() - start, 1e-9)))
+
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(calls):
+            result = function()
+        seconds.append((time.perf_counter() - start) / calls)
+    return min(seconds), result  # Best time per call and the result of the last call
+
+def _gitCommit():
+    import subprocess
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=directory, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None  # Not a git checkout, or git is not installed
+
+def runBenchmarks(observations=12, repeats=3, seed=0, import_time=True, model_calls=1000):
+    import platform
+    import tracemalloc
+
+    times, oppositions = benchmarkDataset(observations, seed)
+    p = BENCHMARK_PARAMS
+    truth = tuple(p[name] for name in ('c', 'r', 'e1', 'e2', 'z', 's'))  # In the order of MarsEquantModel
+    metrics = {}
+
+    # One evaluation of the model
+    seconds, (_, truth_max_error) = _bestTime(
+        lambda: [MarsEquantModel(*truth, times, oppositions) for _ in range(model_calls)][-1], repeats)
+    metrics['model_seconds'] = seconds / model_calls
+
+    # Throughput of the inner search
+    telemetry = SearchTelemetry()
+    bestOrbitInnerParams(p['r'], p['s'], times, oppositions, cache=None, telemetry=telemetry)  # Count one search
+    seconds, _ = _bestTime(lambda: bestOrbitInnerParams(p['r'], p['s'], times, oppositions, cache=None), repeats)
+    metrics['inner_evaluations_per_second'] = telemetry.evaluations / seconds
+
+    # End-to-end searches
+    searches = {'bestS': lambda: bestS(p['r'], times, oppositions, cache=None),
+                'bestR': lambda: bestR(p['s'], times, oppositions, cache=None),
+                'bestMarsOrbitParams': lambda: bestMarsOrbitParams(times, oppositions, cache=None)}
+    for name, search in searches.items():
+        metrics[f'{name}_seconds'], fit = _bestTime(search, repeats)
+
+    tracemalloc.start()
+    bestMarsOrbitParams(times, oppositions, cache=None)
+    metrics['peak_bytes'] = tracemalloc.get_traced_memory()[1]  # Largest memory allocated at once
+    tracemalloc.stop()
+
+    if import_time:
+        metrics['import_seconds'] = measureImportTime(repeats)['module']
+
+    return {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': _gitCommit(), 'backend': compute_backend.name,
+            'numpy': np.__version__, 'python': platform.python_version(), 'observations': observations,
+            'seed': seed, 'repeats': repeats, 'params': dict(p), 'truth_max_error': float(truth_max_error),
+            'fit': [float(value) for value in fit[:6]], 'fit_max_error': float(fit[7]), 'metrics': metrics}
+
+def loadBenchmarks(path=BENCHMARK_HISTORY):
+    if not os.path.exists(path):
+        return []
+    with open(path) as file:
+        return json.load(file)
+
+def saveBenchmark(result, path=BENCHMARK_HISTORY):
+    history = loadBenchmarks(path) + [result]
+    _writeAtomically(path, lambda file: file.write(json.dumps(history, indent=2).encode()))
+    return history
+
+def compareBenchmarks(old, new, tolerance=BENCHMARK_TOLERANCE):
+    rows = []
+    for metric, higher_is_better in BENCHMARK_METRICS.items():
+        if metric not in old['metrics'] or metric not in new['metrics']:
+            continue  # Not measured by both
+        before, after = old['metrics'][metric], new['metrics'][metric]
+        change = after / before - 1 if before else 0.0  # Relative change
+        worse = -change if higher_is_better else change
+        rows.append({'metric': metric, 'old': before, 'new': after, 'change': change, 'regression': worse > tolerance})
+    return rows
+
+"""### Fit job service
+
+`FitService` runs fits for other programs. It is a small asyncio server, over HTTP on a TCP port or on a Unix socket, that runs the jobs on a process pool. A job is a JSON object with a `kind`, the data and the parameters of that kind:
+
+- `mars`: `bestMarsOrbitParams`,
+- `inner`: `bestOrbitInnerParams` for `r` and `s`, with an optional `resolution`,
+- `evaluate`: `MarsEquantModel` for `c`, `r`, `e1`, `e2`, `z` and `s`.
+
+The data is either `data`, the path of an opposition CSV file on the server, or `times` and `oppositions` lists. The path is relative to `data_dir` (the working directory by default), and files outside that directory are refused. A data file is parsed off the event loop, without the cache of `loadOppositions`. Requests with missing or non-numeric parameters, or a `resolution` that is not between 0 and 360 degrees, get status 400. Any other error is logged and answered with status 500. The endpoints are:
+
+- `POST /jobs` submits a job and returns its id and status. With `?wait=1` it returns when the job is finished.
+- `GET /jobs/<id>` returns the status of a job (`queued`, `running`, `done` or `failed`) and, once it is done, its result. `?wait=1` waits for the job too.
+- `GET /metrics` returns the number of jobs queued and running, and counts of the jobs submitted, deduplicated, served from the cache, completed, failed and rejected.
+
+The id of a job is a hash of its kind, its parameters, the inner grid, the compute backend and the fingerprint of its data (`fitJobKey`), so identical jobs have the same id. A job that is already queued or running is not run a second time: the new request gets the same job. Finished results are saved as JSON files in `cache_dir` (`FitResultStore`), so identical jobs are served from there, also after a restart. At most `workers` jobs run at once. When `max_queue` jobs are already waiting, new jobs are rejected with status 503.
+"""
+
+SERVICE_CACHE_DIR = '.fit_service_cache'  # Directory of the results saved by FitService
+SERVICE_DATA_DIR = '.'  # Directory of the data files FitService jobs may name
+JOB_PARAMS = {'mars': (), 'inner': ('r', 's'), 'evaluate': ('c', 'r', 'e1', 'e2', 'z', 's')}  # Parameters of each kind
+HTTP_REASONS = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error',
+                503: 'Service Unavailable'}
+
+def _jobNumber(request, name):
+    value = request[name]
+    try:
+        valid = not isinstance(value, bool) and isinstance(value, (int, float)) and math.isfinite(value)
+    except OverflowError:
+        valid = False  # An integer too large for a float
+    if not valid:
+        raise ValueError(f"{name} must be a number, not {json.dumps(value)}")
+    return float(value)
+
+def _jobDataPath(data, data_dir):
+    # Path of a data file of a job, which must be a file in data_dir
+    if not isinstance(data, str):
+        raise ValueError(f"data must be the path of a CSV file, not {json.dumps(data)}")  # open() takes descriptors
+    root = os.path.realpath(data_dir)
+    path = os.path.realpath(os.path.join(root, data))  # Relative paths are in data_dir
+    if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+        raise ValueError(f"data must be a CSV file in the data directory of the service, not {data}")
+    return path
+
+def fitJobSpec(request, data_dir=SERVICE_DATA_DIR):
+    # Kind, data and parameters of a job request. Raises ValueError if the request is not valid.
+    kind = request.get('kind')
+    if kind not in JOB_PARAMS:
+        raise ValueError(f"kind must be one of {', '.join(JOB_PARAMS)}")
+    if 'data' in request:
+        path = _jobDataPath(request['data'], data_dir)
+        try:
+            times, oppositions = loadOppositions(path, cache=False)  # Leave no cache files behind
+        except OSError as error:
+            raise ValueError(f"cannot read {request['data']}: {error}")
+    elif 'times' in request and 'oppositions' in request:
+        times, oppositions = request['times'], request['oppositions']
+    else:
+        raise ValueError("give either data (a CSV file on the server) or times and oppositions")
+    try:
+        times, oppositions = np.asarray(times, dtype=float), np.asarray(oppositions, dtype=float)
+    except (TypeError, OverflowError):
+        raise ValueError("times and oppositions must be lists of numbers")
+    if times.ndim != 1 or times.shape != oppositions.shape or len(times) == 0:
+        raise ValueError("times and oppositions must be lists of the same non-zero length")
+    if not (np.isfinite(times).all() and np.isfinite(oppositions).all()):
+        raise ValueError("times and oppositions must be lists of numbers")
+
+    params = {}
+    for name in JOB_PARAMS[kind]:
+        if name not in request:
+            raise ValueError(f"{kind} jobs need {', '.join(JOB_PARAMS[kind])}")
+        params[name] = _jobNumber(request, name)
+    if kind == 'inner' and request.get('resolution') is not None:
+        params['resolution'] = _jobNumber(request, 'resolution')
+        if not 0 < params['resolution'] < 360:
+            raise ValueError(f"resolution must be between 0 and 360 degrees, not {params['resolution']}")
+    return kind, times, oppositions, params
+
+def fitJobKey(kind, times, oppositions, params):
+    spec = json.dumps([kind, params, gridKey(), compute_backend.name], sort_keys=True)  # What is computed, and how
+    return hashlib.sha1(f'{spec}:{datasetFingerprint(times, oppositions)}'.encode()).hexdigest()
+
+def runFitJob(kind, times, oppositions, params):
+    if kind == 'mars':
+        r, s, c, e1, e2, z, errors, max_error = bestMarsOrbitParams(times, oppositions)
+        values = {'r': r, 's': s, 'c': c, 'e1': e1, 'e2': e2, 'z': z}
+    elif kind == 'inner':
+        c, e1, e2, z, errors, max_error = bestOrbitInnerParams(params['r'], params['s'], times, oppositions,
+                                                               resolution=params.get('resolution'))
+        values = {'r': params['r'], 's': params['s'], 'c': c, 'e1': e1, 'e2': e2, 'z': z}
+    else:
+        values = {name: params[name] for name in JOB_PARAMS['evaluate']}
+        errors, max_error = MarsEquantModel(*values.values(), times, oppositions)
+    return {'params': {name: float(value) for name, value in values.items()},
+            'errors': [float(error) for error in errors], 'max_error': float(max_error)}
+
+class FitResultStore:
+    def __init__(self, directory=SERVICE_CACHE_DIR):
+        self.directory = directory  # One JSON file per result
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def get(self, key):
+        try:
+            with open(self._path(key)) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None  # Not saved, or not readable
+
+    def put(self, key, result):
+        os.makedirs(self.directory, exist_ok=True)
+        _writeAtomically(self._path(key), lambda file: file.write(json.dumps(result).encode()))
+
+class FitService:
+    def __init__(self, workers=2, max_queue=64, cache_dir=SERVICE_CACHE_DIR, history=1000, data_dir=SERVICE_DATA_DIR):
+        self.workers = workers  # Jobs run at once
+        self.max_queue = max_queue  # Jobs that may wait for a worker
+        self.store = FitResultStore(cache_dir)  # Results of finished jobs
+        self.data_dir = data_dir  # Directory of the data files jobs may name
+        self.history = history  # Finished jobs whose status is kept
+        self.jobs = OrderedDict()  # Jobs by id, oldest first
+        self.in_flight = {}  # Tasks of the jobs that are queued or running, by id
+        self.counts = {'submitted': 0, 'deduplicated': 0, 'cache_hits': 0, 'completed': 0, 'failed': 0, 'rejected': 0}
+        self.run_seconds = 0.0  # Time spent running the completed jobs
+        self.pool = None  # Process pool, created by start
+        self.slots = None  # One slot per worker
+
+    def start(self):
+        import asyncio
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor  # Imported here because it is slow to import
+
+        # Spawned workers do not inherit the listening socket, which would keep the port open after the server
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=selectBackend,
+                                        initargs=(compute_backend.name, False, 1))  # One thread per worker
+        self.slots = asyncio.Semaphore(self.workers)
+
+    def _job(self, key, kind, status, result=None):
+        job = {'id': key, 'kind': kind, 'status': status, 'submitted': time.time(), 'started': None,
+               'finished': None, 'cached': result is not None, 'result': result, 'error': None}
+        self.jobs.pop(key, None)
+        self.jobs[key] = job
+
+        # Forget the oldest finished jobs
+        finished = [old for old in self.jobs if old not in self.in_flight]
+        for old in finished[:max(0, len(finished) - self.history)]:
+            del self.jobs[old]
+        return job
+
+    def _status(self, status):
+        return sum(job['status'] == status for job in self.jobs.values())
+
+    async def submit(self, request):
+        import asyncio
+
+        # Reading a data file can take a while, so it is done off the event loop
+        kind, times, oppositions, params = await asyncio.get_running_loop().run_in_executor(None, fitJobSpec,
+                                                                                            request, self.data_dir)
+        key = fitJobKey(kind, times, oppositions, params)
+        self.counts['submitted'] += 1
+        if key in self.in_flight:
+            self.counts['deduplicated'] += 1
+            return self.jobs[key]  # Already queued or running
+        result = self.store.get(key)
+        if result is not None:
+            self.counts['cache_hits'] += 1
+            return self._job(key, kind, 'done', result)
+        if self._status('queued') >= self.max_queue:
+            self.counts['rejected'] += 1
+            return None
+
+        job = self._job(key, kind, 'queued')
+        self.in_flight[key] = asyncio.ensure_future(self._run(job, times, oppositions, params))
+        return job
+
+    async def _run(self, job, times, oppositions, params):
+        import asyncio
+
+        async with self.slots:
+            job['status'], job['started'] = 'running', time.time()
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(self.pool, runFitJob, job['kind'], times,
+                                                                          oppositions, params)
+            except Exception as error:  # The service keeps running when a job fails
+                job['status'], job['error'] = 'failed', f'{type(error).__name__}: {error}'
+                self.counts['failed'] += 1
+            else:
+                self.store.put(job['id'], result)
+                job['status'], job['result'] = 'done', result
+                self.counts['completed'] += 1
+                self.run_seconds += time.time() - job['started']
+            finally:
+                job['finished'] = time.time()
+                del self.in_flight[job['id']]
+
+    async def wait(self, key):
+        import asyncio
+
+        if key in self.in_flight:
+            await asyncio.shield(self.in_flight[key])  # A client that goes away does not cancel the job
+
+    def metrics(self):
+        return {**self.counts, 'queued': self._status('queued'), 'running': self._status('running'),
+                'workers': self.workers, 'max_queue': self.max_queue, 'jobs': len(self.jobs),
+                'mean_run_seconds': self.run_seconds / self.counts['completed'] if self.counts['completed'] else 0.0,
+                'backend': compute_backend.name}
+
+    async def route(self, method, target, body):
+        from urllib.parse import parse_qs, urlsplit
+
+        url = urlsplit(target)
+        wait = parse_qs(url.query).get('wait', ['0'])[0] not in ('', '0')  # ?wait=1 waits for the job
+        if method == 'POST' and url.path == '/jobs':
+            request = json.loads(body or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError("a job is a JSON object")
+            job = await self.submit(request)
+            if job is None:
+                return 503, {'error': f'{self.max_queue} jobs are already queued'}
+        elif method == 'GET' and url.path.startswith('/jobs/'):
+            job = self.jobs.get(url.path[len('/jobs/'):])
+            if job is None:
+                return 404, {'error': 'unknown job'}
+        elif method == 'GET' and url.path == '/metrics':
+            return 200, self.metrics()
+        else:
+            return 404, {'error': f'no endpoint {method} {url.path}'}
+        if wait:
+            await self.wait(job['id'])
+        return (200 if job['status'] in ('done', 'failed') else 202), job
+
+    async def handle(self, reader, writer):
+        import asyncio
+
+        # One request per connection: request line, headers, then a body of Content-Length bytes
+        try:
+            method, target, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            status, payload = await self.route(method, target, body)
+        except (ValueError, TypeError, asyncio.IncompleteReadError) as error:  # A bad request
+            status, payload = 400, {'error': str(error)}
+        except Exception as error:  # Answer anyway, so that no request drops its connection silently
+            import traceback
+
+            traceback.print_exc()  # Log the error on stderr
+            status, payload = 500, {'error': f'{type(error).__name__}: {error}'}
+
+        data = json.dumps(payload).encode()
+        writer.write(f'HTTP/1.1 {status} {HTTP_REASONS[status]}\r\nContent-Type: application/json\r\n'
+                     f'Content-Length: {len(data)}\r\nConnection: close\r\n\r\n'.encode() + data)
+        await writer.drain()
+        writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8765, path=None, started=None):
+        import asyncio
+        import signal
+
+        self.start()
+        if path is None:
+            server = await asyncio.start_server(self.handle, host, port)
+        else:
+            server = await asyncio.start_unix_server(self.handle, path)
+        stop = asyncio.Event()  # Set by SIGINT or SIGTERM
+        for number in (signal.SIGINT, signal.SIGTERM):
+            asyncio.get_running_loop().add_signal_handler(number, stop.set)
+        if started is not None:
+            started(server)  # Called once the server listens
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            self.pool.shutdown(cancel_futures=True)  # Stop the workers
+            if path is not None and os.path.exists(path):
+                os.remove(path)  # Remove the socket file
+
+def serveFits(host='127.0.0.1', port=8765, path=None, workers=2, max_queue=64, cache_dir=SERVICE_CACHE_DIR,
+              started=None, data_dir=SERVICE_DATA_DIR):
+    import asyncio
+
+    asyncio.run(FitService(workers, max_queue, cache_dir, data_dir=data_dir).serve(host, port, path, started))
+
+"""### Print and plot the results"""
+
+def printOrbitParams(params, title='Best parameters'):
+    r, s, c, e1, e2, z, errors, max_error = params  # Unpack the parameters
+
+    print(f"\n{title}:")
+    print(f"r = {r:.6f}")
+    print(f"s = {s:.6f}")
+    print(f"c = {c:.6f}")
+    print(f"e1 = {e1:.6f}")
+    print(f"e2 = {e2:.6f}")
+    print(f"z = {z:.6f}")
+    print(f"Maximum error = {max_error:.6f}")
+
+    # Print the complete errors array
+    print("\nErrors array:")
+    print(errors)
+
+def plotPredictedOppositions(oppositions, errors, output=None):
+    plt = _pyplot(output)
+
+    # Calculate predicted oppositions by subtracting errors from actual oppositions
+    predicted_oppositions = oppositions - errors
+
+    # Create a scatter plot
+    plt.figure(figsize=(12, 8))
+
+    # Plot actual oppositions
+    plt.scatter(range(len(oppositions)), oppositions, color='blue', label='Actual Oppositions')
+
+    # Plot predicted oppositions
+    plt.scatter(range(len(predicted_oppositions)), predicted_oppositions, color='red', label='Predicted Oppositions')
+
+    # Customize the plot
+    plt.xlabel('Observation Index')
+    plt.ylabel('Opposition (degrees)')
+    plt.title('Actual vs Predicted Mars Oppositions')
+    plt.legend()
+
+    # Add a grid for better readability
+    plt.grid(True, linestyle='--', alpha=0.7)
+
+    _finishPlot(plt, output)
+
+    # Calculate and return the correlation coefficient
+    return np.corrcoef(oppositions, predicted_oppositions)[0, 1]
+
+"""### Command line
+
+`python Assignment2.py <command>` runs the steps of the notebook without a display:
+
+- `fit` loads the data, runs one of the searches (`--search mars`, `s`, `r` or `inner`) and prints the best parameters. `--refine` refines the result continuously, `--progress` prints progress and `--profile FILE` writes a profile of the search.
+- `tiles` runs the `bestMarsOrbitParams` grid, optionally at a finer `--resolution`, in tiles that fit in `--memory-budget` megabytes and reports the throughput of the tiles. With `--checkpoint FILE` it saves its state as it runs, and `--resume` continues from that file. The checkpoint keeps the best 10 points, so `--top` can change between runs as long as it stays at most 10. `--landscape DIR` (also for `fit`) saves the max error of every grid point.
+- `landscape DIR` prints the axes of an error landscape saved with `--landscape DIR` and its best points, optionally in a box given by `--where`.
+- `uncertainty` fits bootstrap resamples (`--method bootstrap`) or leave-one-out datasets (`--method loo`) of the data and prints a confidence interval for every parameter.
+- `evaluate c r e1 e2 z s` prints the errors of one parameter set.
+- `plot assumptions|observations|fit` draws one of the figures, to `--output` if given.
+- `scaling` benchmarks the inner search on synthetic datasets of increasing size.
+- `bench` runs the benchmarks on synthetic data, adds them to the `--history` file and compares them with the last result in it.
+- `serve` runs a `FitService` that takes fit jobs over HTTP (`--port`) or a Unix socket (`--unix`).
+- `importtime` measures how long it takes to import this module, on top of numpy.
+"""
 
-# Calculate and print the correlation coefficient
-correlation = np.corrcoef(oppositions, predicted_oppositions)[0, 1]
-print(f"\nCorrelation coefficient between actual and predicted oppositions: {correlation:.4f}")
\ No newline at end of file
+def measureImportTime(repeats=5):
+    import os
+    import subprocess
+    import sys
+
+    code = ("import time; start = time.perf_counter(); import numpy; middle = time.perf_counter(); "
+            "import Assignment2; end = time.perf_counter(); print(middle - start, end - middle)")
+    directory = os.path.dirname(os.path.abspath(__file__))  # Import this copy of the module
+    samples = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', code], cwd=directory, capture_output=True, text=True,
+                                check=True).stdout
+        samples.append([float(value) for value in output.split()])
+    numpy_time, module_time = np.min(samples, axis=0)  # Best of the repeats
+    return {'numpy': numpy_time, 'module': module_time}
+
+def _runFit(args):
+    times, oppositions = loadOppositions(args.data)
+    telemetry = SearchTelemetry(callback=printProgress if args.progress else None)
+    options = {'workers': args.workers, 'early_abandon': args.early_abandon or None, 'telemetry': telemetry,
+               'memory_budget': args.memory_budget * 2 ** 20 if args.memory_budget else None}
+
+    def search():
+        if args.search == 'inner':
+            c, e1, e2, z, errors, max_error = bestOrbitInnerParams(args.r, args.s, times, oppositions,
+                                                                   resolution=args.resolution,
+                                                                   landscape=args.landscape, **options)
+            return args.r, args.s, c, e1, e2, z, errors, max_error
+        if args.search == 's':
+            return bestS(args.r, times, oppositions, **options)
+        if args.search == 'r':
+            return bestR(args.s, times, oppositions, **options)
+        return bestMarsOrbitParams(times, oppositions, checkpoint=args.checkpoint, resume=args.resume,
+                                   landscape=args.landscape, **options)
+
+    if args.profile:
+        params = profileSearch(search, output=args.profile, profiler=args.profiler)
+    else:
+        params = search()
+    printOrbitParams(params)
+    if telemetry.direct_transcendental_calls:
+        print(f"\nRotation tables: {telemetry.transcendental_calls} transcendental calls instead of "
+              f"{telemetry.direct_transcendental_calls} "
+              f"({telemetry.direct_transcendental_calls / telemetry.transcendental_calls:.1f}x fewer)")
+    if telemetry.residuals_computed or telemetry.residuals_skipped:
+        total = telemetry.residuals_computed + telemetry.residuals_skipped
+        print(f"\nEarly abandon: {telemetry.residuals_computed} residuals computed, "
+              f"{telemetry.residuals_skipped} skipped ({telemetry.residuals_skipped / total:.1%})")
+
+    if args.refine:
+        # The full search refines its best few grid points, the others refine their best point
+        candidates = None if args.search == 'mars' else [params]
+        params, stats = refineMarsOrbitParams(times, oppositions, candidates, telemetry=telemetry)
+        printOrbitParams(params, f"Refined parameters ({stats['evaluations']} model evaluations)")
+
+def _runTiles(args):
+    times, oppositions = loadOppositions(args.data)
+    grid = DEFAULT_INNER_GRID if args.resolution is None else fineInnerGrid(args.resolution)
+    r_range, s_range = marsOrbitSearchRanges()
+    dtype = np.float32 if args.float32 else np.float64
+    # k is part of the checkpoint, so keep the same k whatever --top is and cut the list below
+    k = max(args.top, CHECKPOINT_TOP) if args.checkpoint else args.top
+    _, top, stats = tiledGridSearch(r_range, s_range, times, oppositions, grid, args.memory_budget * 2 ** 20,
+                                    k, dtype, checkpoint=args.checkpoint, resume=args.resume,
+                                    landscape=args.landscape)
+    if stats['resumed_tiles']:
+        print(f"Resumed after {stats['resumed_tiles']} finished tiles")
+    print(f"{stats['tiles']} tiles, {stats['points']} points in {stats['seconds']:.2f}s "
+          f"({stats['points_per_second']:.3g} points/s)")
+    if stats['tiles']:  # A finished checkpoint leaves no tiles to score
+        rates = np.array(stats['tile_points_per_second'])
+        print(f"Points per second per tile: min {rates.min():.3g}, median {np.median(rates):.3g}, "
+              f"max {rates.max():.3g}")
+    for rank, params in enumerate(top[:args.top], start=1):
+        printOrbitParams(params, f'Top {rank}')
+
+def _runLandscape(args):
+    landscape = ErrorLandscape(args.path)
+    box = {}
+    for condition in args.where:
+        name, _, bounds = condition.partition('=')
+        low, _, high = bounds.partition(':')
+        box[name] = (float(low), float(high or low))  # NAME=VALUE or NAME=LOW:HIGH
+    print(f"Landscape of {landscape.meta['observations']} observations, "
+          f"{'complete' if landscape.meta['complete'] else 'incomplete'}")
+    for name, size in zip(LANDSCAPE_AXES, landscape.shape):
+        values = landscape.axes[name]
+        print(f"{name:>4}: {size} values from {values[0]:g} to {values[-1]:g}")
+    print(f"\n{'r':>10} {'s':>10} {'c':>8} {'e1':>8} {'e2':>8} {'z':>8} {'max error':>12}")
+    for point in landscape.top(args.top, **box):
+        print(f"{point[0]:>10.6f} {point[1]:>10.6f} {point[2]:>8g} {point[3]:>8g} {point[4]:>8g} {point[5]:>8g} "
+              f"{point[6]:>12.6f}")
+
+def _runUncertainty(args):
+    times, oppositions = loadOppositions(args.data)
+    result = fitUncertainty(times, oppositions, args.method, args.resamples, args.seed, args.confidence, args.refine,
+                            args.workers)
+    n_fits = len(result['fits']) + 1  # The resampled datasets and the full data
+    print(f"{n_fits} fits in {result['seconds']:.2f}s ({result['fits_per_second']:.1f} fits/s)")
+    print(f"\n{'':>4} {'estimate':>12} {'mean':>12} {'std':>12}   {result['confidence']:.0%} interval")
+    for name, summary in result['parameters'].items():
+        low, high = summary['interval']
+        print(f"{name:>4} {summary['estimate']:>12.6f} {summary['mean']:>12.6f} {summary['std']:>12.6f}   "
+              f"[{low:.6f}, {high:.6f}]")
+
+def _runEvaluate(args):
+    times, oppositions = loadOppositions(args.data)
+    errors, max_error = MarsEquantModel(args.c, args.r, args.e1, args.e2, args.z, args.s, times, oppositions)
+    print("Errors array:")
+    print(errors)
+    print(f"Maximum error = {max_error:.6f}")
+
+def _runPlot(args):
+    if args.figure == 'assumptions':
+        plotModelAssumptions(output=args.output)
+        return
+    times, oppositions = loadOppositions(args.data)
+    if args.figure == 'observations':
+        plotObservedLongitudes(times, oppositions, output=args.output)
+        return
+    params = bestMarsOrbitParams(times, oppositions)
+    correlation = plotPredictedOppositions(oppositions, params[6], output=args.output)
+    print(f"Correlation coefficient between actual and predicted oppositions: {correlation:.4f}")
+
+def _runScaling(args):
+    print(f"{'observations':>12} {'seconds':>10} {'peak MB':>10} {'errors/s':>12}")
+    for result in benchmarkObservationScaling(args.counts):
+        print(f"{result['observations']:>12} {result['seconds']:>10.3f} {result['peak_bytes'] / 2 ** 20:>10.1f} "
+              f"{result['errors_per_second']:>12.3g}")
+
+def _runBench(args):
+    result = runBenchmarks(args.observations, args.repeats, args.seed, import_time=not args.no_import_time)
+    print(f"Benchmarks on {result['observations']} synthetic observations, backend {result['backend']}, "
+          f"commit {result['commit']}")
+    for metric, value in result['metrics'].items():
+        print(f"{metric:>30} {value:>12.4g}")
+    print(f"Max error of the true parameters: {result['truth_max_error']:.4f}, "
+          f"of the bestMarsOrbitParams fit: {result['fit_max_error']:.4f}")
+
+    # Compare with the last result on the same dataset and backend
+    history = loadBenchmarks(args.history)
+    previous = [old for old in history if (old['observations'], old['seed'], old['backend']) ==
+                (result['observations'], result['seed'], result['backend'])]
+    if previous:
+        print(f"\nChange since {previous[-1]['timestamp']} (commit {previous[-1]['commit']}):")
+        for row in compareBenchmarks(previous[-1], result, args.tolerance):
+            flag = '  REGRESSION' if row['regression'] else ''
+            print(f"{row['metric']:>30} {row['old']:>12.4g} -> {row['new']:>12.4g} {row['change']:>+8.1%}{flag}")
+    if not args.no_save:
+        saveBenchmark(result, args.history)
+        print(f"Saved to {args.history}")
+
+def _runServe(args):
+    def started(server):
+        print(f"Serving fit jobs on {args.unix or f'http://{args.host}:{args.port}'} with {args.workers} workers")
+
+    serveFits(args.host, args.port, args.unix, args.workers, args.max_queue, args.cache_dir, started, args.data_dir)
+    print("Stopped")
+
+def _runImportTime(args):
+    timing = measureImportTime(args.repeats)
+    print(f"import numpy: {timing['numpy'] * 1000:.1f} ms")
+    print(f"import Assignment2 (after numpy): {timing['module'] * 1000:.1f} ms")
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fit the equant model of Mars' orbit to opposition data.")
+    parser.add_argument('--backend', choices=['auto', *BACKENDS], default='numpy',
+                        help='compute backend of the searches (default numpy)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    fit = commands.add_parser('fit', help='search for the best orbit parameters')
+    fit.add_argument('--data', default=DATA_FILE, help='opposition data CSV file')
+    fit.add_argument('--search', choices=['mars', 's', 'r', 'inner'], default='mars',
+                     help='bestMarsOrbitParams, bestS, bestR or bestOrbitInnerParams')
+    fit.add_argument('--r', type=float, default=1.52, help='fixed r for --search s and inner')
+    fit.add_argument('--s', type=float, default=0.518195, help='fixed s for --search r and inner')
+    fit.add_argument('--resolution', type=float, help='branch-and-bound resolution in degrees for --search inner')
+    fit.add_argument('--workers', type=int, help='number of worker processes')
+    fit.add_argument('--early-abandon', action='store_true', help='stop scoring parameter sets that cannot win')
+    fit.add_argument('--memory-budget', type=float, metavar='MB', help='score the grid in tiles that fit in MB')
+    fit.add_argument('--checkpoint', metavar='FILE', help='save the state of --search mars to FILE as it runs')
+    fit.add_argument('--resume', action='store_true', help='continue from --checkpoint if it exists')
+    fit.add_argument('--landscape', metavar='DIR', help='save the max error of every grid point to DIR')
+    fit.add_argument('--refine', action='store_true', help='refine the result continuously')
+    fit.add_argument('--progress', action='store_true', help='print progress while searching')
+    fit.add_argument('--profile', metavar='FILE', help='write a profile of the search to FILE')
+    fit.add_argument('--profiler', choices=['cprofile', 'sampling'], default='cprofile')
+    fit.set_defaults(run=_runFit)
+
+    tiles = commands.add_parser('tiles', help='run the bestMarsOrbitParams grid in tiles and report their throughput')
+    tiles.add_argument('--data', default=DATA_FILE, help='opposition data CSV file')
+    tiles.add_argument('--resolution', type=float, help='angle step of the inner grid in degrees (default 20)')
+    tiles.add_argument('--memory-budget', type=float, default=DEFAULT_MEMORY_BUDGET / 2 ** 20, metavar='MB')
+    tiles.add_argument('--float32', action='store_true', help='compute the errors in single precision')
+    tiles.add_argument('--top', type=int, default=1,
+                       help=f'number of best points to print (at most {CHECKPOINT_TOP} to resume a checkpoint)')
+    tiles.add_argument('--checkpoint', metavar='FILE', help='save the state of the search to FILE as it runs')
+    tiles.add_argument('--resume', action='store_true', help='continue from --checkpoint if it exists')
+    tiles.add_argument('--landscape', metavar='DIR', help='save the max error of every grid point to DIR')
+    tiles.set_defaults(run=_runTiles)
+
+    landscape = commands.add_parser('landscape', help='query an error landscape saved by fit or tiles')
+    landscape.add_argument('path', help='directory of the landscape')
+    landscape.add_argument('--top', type=int, default=5, help='number of best points to print')
+    landscape.add_argument('--where', nargs='*', default=[], metavar='NAME=LOW:HIGH',
+                           help='limit an axis to a value or a range of values, e.g. r=1.45:1.55 z=60')
+    landscape.set_defaults(run=_runLandscape)
+
+    uncertainty = commands.add_parser('uncertainty', help='bootstrap or leave-one-out error bars on the parameters')
+    uncertainty.add_argument('--data', default=DATA_FILE, help='opposition data CSV file')
+    uncertainty.add_argument('--method', choices=['bootstrap', 'loo'], default='bootstrap')
+    uncertainty.add_argument('--resamples', type=int, default=200, help='number of bootstrap resamples')
+    uncertainty.add_argument('--seed', type=int, default=0, help='seed of the bootstrap resamples')
+    uncertainty.add_argument('--confidence', type=float, default=0.95, help='confidence level of the intervals')
+    uncertainty.add_argument('--refine', action='store_true', help='refine every fit continuously')
+    uncertainty.add_argument('--workers', type=int, help='number of worker processes')
+    uncertainty.set_defaults(run=_runUncertainty)
+
+    evaluate = commands.add_parser('evaluate', help='print the errors of one parameter set')
+    for name in ('c', 'r', 'e1', 'e2', 'z', 's'):
+        evaluate.add_argument(name, type=float)
+    evaluate.add_argument('--data', default=DATA_FILE, help='opposition data CSV file')
+    evaluate.set_defaults(run=_runEvaluate)
+
+    plot = commands.add_parser('plot', help='draw a figure')
+    plot.add_argument('figure', choices=['assumptions', 'observations', 'fit'])
+    plot.add_argument('--data', default=DATA_FILE, help='opposition data CSV file')
+    plot.add_argument('--output', help='save the figure to this file instead of showing it')
+    plot.set_defaults(run=_runPlot)
+
+    scaling = commands.add_parser('scaling', help='benchmark the inner search against the number of observations')
+    scaling.add_argument('--counts', type=int, nargs='+', default=[12, 120, 1200, 12000, 120000])
+    scaling.set_defaults(run=_runScaling)
+
+    bench = commands.add_parser('bench', help='benchmark the model and the searches on synthetic data')
+    bench.add_argument('--observations', type=int, default=12, help='number of synthetic observations')
+    bench.add_argument('--repeats', type=int, default=3, help='runs of each timing, the best one is kept')
+    bench.add_argument('--seed', type=int, default=0, help='seed of the synthetic observations')
+    bench.add_argument('--history', default=BENCHMARK_HISTORY, help='JSON history file of the results')
+    bench.add_argument('--tolerance', type=float, default=BENCHMARK_TOLERANCE,
+                       help='relative change reported as a regression')
+    bench.add_argument('--no-save', action='store_true', help='do not add the result to the history')
+    bench.add_argument('--no-import-time', action='store_true', help='do not measure the import time')
+    bench.set_defaults(run=_runBench)
+
+    serve = commands.add_parser('serve', help='run fit jobs sent over HTTP or a Unix socket')
+    serve.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    serve.add_argument('--port', type=int, default=8765, help='TCP port to listen on')
+    serve.add_argument('--unix', metavar='PATH', help='listen on this Unix socket instead of a TCP port')
+    serve.add_argument('--workers', type=int, default=2, help='number of worker processes')
+    serve.add_argument('--max-queue', type=int, default=64, help='largest number of jobs waiting for a worker')
+    serve.add_argument('--cache-dir', default=SERVICE_CACHE_DIR, help='directory of the saved results')
+    serve.add_argument('--data-dir', default=SERVICE_DATA_DIR, help='directory of the data files jobs may name')
+    serve.set_defaults(run=_runServe)
+
+    importtime = commands.add_parser('importtime', help='measure the import time of this module')
+    importtime.add_argument('--repeats', type=int, default=5)
+    importtime.set_defaults(run=_runImportTime)
+
+    args = parser.parse_args(argv)
+    if args.backend != 'numpy':
+        backend = selectBackend(args.backend)
+        if args.backend not in ('auto', backend.name):
+            print(f"Backend {args.backend} is not available or failed its self-check, using {backend.name}")
+        else:
+            print(f"Backend: {backend.name}")
+    args.run(args)
+
+if __name__ == '__main__':
+    main()